@@ -9,3 +9,6 @@ INSERT INTO artworks (title, artist_name, description, medium, dimensions, price
 ('Cosmic Energy', 'Robert Taylor', 'Abstract space-inspired composition', 'Acrylic on canvas', '36x48 inches', 890.00, 'img/feature-slide-2.png', 'available'),
 ('Tranquil Garden', 'Maria Garcia', 'Japanese garden in peaceful setting', 'Oil on canvas', '22x28 inches', 510.00, 'img/feature-slide-3.png', 'available');
 
+UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+INSERT INTO catalog_changes (version, artwork_id)
+SELECT v.version, a.id FROM catalog_version v CROSS JOIN artworks a WHERE v.id = 1;
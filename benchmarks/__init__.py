@@ -0,0 +1,40 @@
+import os
+import threading
+from MySQLdb.cursors import DictCursor
+
+# Shared settings for the benchmark scripts. They run against a dedicated
+# MySQL schema (artspace_bench by default) that seed.py drops and rebuilds,
+# never against the application database.
+
+BENCH_CONFIG = {
+    'MYSQL_HOST': os.environ.get('BENCH_MYSQL_HOST', 'localhost'),
+    'MYSQL_PORT': int(os.environ.get('BENCH_MYSQL_PORT', 3306)),
+    'MYSQL_USER': os.environ.get('BENCH_MYSQL_USER', 'root'),
+    'MYSQL_PASSWORD': os.environ.get('BENCH_MYSQL_PASSWORD', ''),
+    'MYSQL_DB': os.environ.get('BENCH_MYSQL_DB', 'artspace_bench'),
+    'WTF_CSRF_ENABLED': False,
+    'PASSWORD_HASH_WORKERS': 0,
+    'JOBS_WORKERS': 0,
+}
+
+BENCH_PASSWORD = 'benchmark-password'
+
+_counter = threading.local()
+
+class CountingCursor(DictCursor):
+    # DictCursor that counts statements per thread, for queries-per-request.
+    def execute(self, query, args=None):
+        _counter.queries = getattr(_counter, 'queries', 0) + 1
+        return super().execute(query, args)
+
+def reset_query_count():
+    _counter.queries = 0
+
+def query_count():
+    return getattr(_counter, 'queries', 0)
+
+def bench_app(**overrides):
+    from project import create_app
+    config = dict(BENCH_CONFIG, MYSQL_CURSORCLASS=CountingCursor)
+    config.update(overrides)
+    return create_app(config)
@@ -0,0 +1,150 @@
+import argparse
+import json
+import math
+import random
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from benchmarks import bench_app, query_count, reset_query_count
+
+# Replays shopper sessions through the Flask test client from several threads
+# and reports per-route latency percentiles, throughput and queries per
+# request. Run benchmarks.seed first.
+#
+#   python -m benchmarks.loadtest --users 16 --sessions 50 --out results.json
+#   python -m benchmarks.loadtest --compare results.json
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile.
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.queries = defaultdict(int)
+        self.errors = defaultdict(int)
+
+    def request(self, route, call):
+        reset_query_count()
+        started = time.perf_counter()
+        response = call()
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.samples[route].append(elapsed)
+            self.queries[route] += query_count()
+            if response.status_code >= 400:
+                self.errors[route] += 1
+        return response
+
+def shopper(app, recorder, user_id, sessions, artwork_ids, rng):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    for _ in range(sessions):
+        sort = rng.choice(['newest', 'price_asc', 'price_desc'])
+        recorder.request('GET /artworks', lambda: client.get(f'/artworks?sort={sort}'))
+        if rng.random() < 0.3:
+            term = rng.choice(['oil', 'sunset', 'water', 'urban garden', 'mount'])
+            recorder.request('GET /artworks?query', lambda: client.get(f'/artworks?query={term}'))
+        artwork_id = rng.choice(artwork_ids)
+        recorder.request('GET /artwork/<id>', lambda: client.get(f'/artwork/{artwork_id}'))
+        if rng.random() < 0.5:
+            recorder.request('POST /add-to-cart/<id>', lambda: client.post(f'/add-to-cart/{artwork_id}'))
+            recorder.request('GET /basket', lambda: client.get('/basket'))
+            if rng.random() < 0.3:
+                recorder.request('GET /checkout', lambda: client.get('/checkout'))
+                recorder.request('POST /process-payment', lambda: client.post('/process-payment'))
+
+def available_artwork_ids(app, limit):
+    from project import mysql
+    with app.app_context():
+        cur = mysql.connection.cursor()
+        cur.execute("SELECT id FROM artworks WHERE status = 'available' ORDER BY id LIMIT %s", (limit,))
+        ids = [row['id'] for row in cur.fetchall()]
+        cur.close()
+    return ids
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(users, sessions, seed_value):
+    app = bench_app(MYSQL_POOL_SIZE=users)
+    artwork_ids = available_artwork_ids(app, 20000)
+    recorder = Recorder()
+    threads = [threading.Thread(target=shopper,
+                                args=(app, recorder, user_id, sessions, artwork_ids, random.Random(seed_value + user_id)))
+               for user_id in range(1, users + 1)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    routes = {}
+    for route, samples in sorted(recorder.samples.items()):
+        samples.sort()
+        routes[route] = {
+            'count': len(samples),
+            'errors': recorder.errors[route],
+            'p50_ms': percentile(samples, 50) * 1000,
+            'p95_ms': percentile(samples, 95) * 1000,
+            'p99_ms': percentile(samples, 99) * 1000,
+            'queries_per_request': recorder.queries[route] / len(samples),
+        }
+    total = sum(route['count'] for route in routes.values())
+    return {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'params': {'users': users, 'sessions': sessions, 'seed': seed_value},
+        'wall_seconds': wall,
+        'requests': total,
+        'throughput_rps': total / wall if wall else 0.0,
+        'routes': routes,
+    }
+
+def report(result, baseline=None):
+    print(f"commit {result['commit']}  {result['requests']} requests in {result['wall_seconds']:.1f}s  "
+          f"{result['throughput_rps']:.1f} req/s")
+    if baseline:
+        print(f"baseline {baseline['commit']}  {baseline['throughput_rps']:.1f} req/s")
+    print(f"{'route':<26}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'q/req':>7}{'err':>5}")
+    for route, stats in result['routes'].items():
+        print(f"{route:<26}{stats['count']:>7}{stats['p50_ms']:>9.2f}{stats['p95_ms']:>9.2f}"
+              f"{stats['p99_ms']:>9.2f}{stats['queries_per_request']:>7.2f}{stats['errors']:>5}")
+        old = (baseline or {}).get('routes', {}).get(route)
+        if old:
+            print(f"{'  vs baseline':<26}{'':>7}{stats['p50_ms'] - old['p50_ms']:>+9.2f}"
+                  f"{stats['p95_ms'] - old['p95_ms']:>+9.2f}{stats['p99_ms'] - old['p99_ms']:>+9.2f}"
+                  f"{stats['queries_per_request'] - old['queries_per_request']:>+7.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent shopper-flow load test.')
+    parser.add_argument('--users', type=int, default=16, help='concurrent simulated shoppers')
+    parser.add_argument('--sessions', type=int, default=50, help='browse sessions per shopper')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--out', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results from an earlier run to diff against')
+    args = parser.parse_args()
+
+    result = run(args.users, args.sessions, args.seed)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(result, baseline)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import argparse
+import json
+import random
+import time
+from benchmarks import bench_app, query_count, reset_query_count
+
+# Micro-benchmarks for individual db-layer calls, cold (caches cleared before
+# every call) and warm. Run benchmarks.seed first.
+#
+#   python -m benchmarks.micro --repeat 500
+
+def measure(fn, repeat, before=None):
+    timings = []
+    queries = 0
+    for i in range(repeat):
+        if before:
+            before()
+        reset_query_count()
+        started = time.perf_counter()
+        fn(i)
+        timings.append(time.perf_counter() - started)
+        queries += query_count()
+    timings.sort()
+    return {
+        'p50_us': timings[len(timings) // 2] * 1e6,
+        'p95_us': timings[int(len(timings) * 0.95)] * 1e6,
+        'queries_per_call': queries / repeat,
+    }
+
+def run(repeat, seed_value):
+    from project import db
+    from project.cache import cart_count_cache, catalog_cache, user_cache
+    from project.search import search_artworks, search_index
+
+    rng = random.Random(seed_value)
+    app = bench_app()
+    results = {}
+    with app.test_request_context():
+        artwork_ids = [row['id'] for row in db.get_artworks_page(sort='id', limit=1000).items]
+        cursors = []
+        page = db.get_artworks_page(sort='price_asc', limit=24)
+        while page.next_cursor and len(cursors) < 50:
+            cursors.append(page.next_cursor)
+            page = db.get_artworks_page(sort='price_asc', after=page.next_cursor, limit=24)
+
+        cases = {
+            'get_artworks_page(first)': lambda i: db.get_artworks_page(sort=rng.choice(list(db.ARTWORK_SORTS))),
+            'get_artworks_page(deep)': lambda i: db.get_artworks_page(sort='price_asc', after=cursors[i % len(cursors)]),
+            'get_artwork_by_id': lambda i: db.get_artwork_by_id(rng.choice(artwork_ids)),
+            'get_session_user': lambda i: db.get_session_user(rng.randint(1, 1000)),
+            'get_cart_count': lambda i: db.get_cart_count(rng.randint(1, 1000)),
+            'get_cart_items': lambda i: db.get_cart_items(rng.randint(1, 1000)),
+            'search_artworks': lambda i: search_artworks(rng.choice(['oil', 'sunset', 'wat', 'urban garden'])),
+        }
+
+        def clear_caches():
+            catalog_cache.clear()
+            user_cache.clear()
+            cart_count_cache.clear()
+
+        for name, fn in cases.items():
+            if name == 'search_artworks':
+                search_index.clear()
+                search_artworks('warmup')
+                results[name] = {'warm': measure(fn, repeat)}
+                continue
+            results[name] = {'cold': measure(fn, repeat, before=clear_caches), 'warm': measure(fn, repeat)}
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='db-layer micro-benchmarks.')
+    parser.add_argument('--repeat', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--out', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    results = run(args.repeat, args.seed)
+    print(f"{'call':<28}{'mode':<6}{'p50 us':>10}{'p95 us':>10}{'q/call':>8}")
+    for name, modes in results.items():
+        for mode, stats in modes.items():
+            print(f"{name:<28}{mode:<6}{stats['p50_us']:>10.1f}{stats['p95_us']:>10.1f}{stats['queries_per_call']:>8.2f}")
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+import MySQLdb
+from werkzeug.security import generate_password_hash
+from benchmarks import BENCH_CONFIG, BENCH_PASSWORD, bench_app
+
+# Builds a synthetic catalog in the benchmark schema, shaped like
+# add_data.sql but at production scale. Seeded RNG, so the same arguments
+# give the same data on every run and results stay comparable across commits.
+#
+#   python -m benchmarks.seed --artworks 50000 --users 5000
+
+SCHEMA = Path(__file__).resolve().parent.parent / 'database.sql'
+
+MEDIUMS = ['Acrylic on canvas', 'Oil on canvas', 'Watercolor', 'Mixed media', 'Charcoal on paper',
+           'Digital print', 'Gouache', 'Ink on paper', 'Pastel', 'Photography']
+ADJECTIVES = ['Abstract', 'Silent', 'Golden', 'Urban', 'Tranquil', 'Cosmic', 'Faded', 'Crimson', 'Northern',
+              'Hidden', 'Morning', 'Wild', 'Quiet', 'Electric', 'Distant']
+NOUNS = ['Sunset', 'Mountain', 'Waves', 'Dreams', 'Forest', 'Lights', 'Bloom', 'Garden', 'Harbor', 'Horizon',
+         'Portrait', 'River', 'Storm', 'Meadow', 'Skyline']
+DESCRIPTIONS = ['A vibrant piece capturing the essence of {noun}',
+                'Peaceful study of {noun} in {medium}',
+                'Dynamic composition inspired by {noun} and light',
+                'Contemporary take on the {noun} with layered textures']
+FIRST_NAMES = ['Sarah', 'Michael', 'Emma', 'David', 'Lisa', 'James', 'Anna', 'Robert', 'Maria', 'Chen', 'Amir', 'Noor']
+LAST_NAMES = ['Johnson', 'Chen', 'Davis', 'Martinez', 'Anderson', 'Wilson', 'Thompson', 'Taylor', 'Garcia', 'Okafor']
+IMAGES = ['img/feature-slide-1.png', 'img/feature-slide-2.png', 'img/feature-slide-3.png']
+BATCH_SIZE = 1000
+
+def connect(database=None):
+    kwargs = dict(host=BENCH_CONFIG['MYSQL_HOST'], port=BENCH_CONFIG['MYSQL_PORT'],
+                  user=BENCH_CONFIG['MYSQL_USER'], charset='utf8')
+    if BENCH_CONFIG['MYSQL_PASSWORD']:
+        kwargs['passwd'] = BENCH_CONFIG['MYSQL_PASSWORD']
+    if database:
+        kwargs['db'] = database
+    return MySQLdb.connect(**kwargs)
+
+def create_schema():
+    database = BENCH_CONFIG['MYSQL_DB']
+    conn = connect()
+    cur = conn.cursor()
+    cur.execute(f"DROP DATABASE IF EXISTS `{database}`")
+    cur.execute(f"CREATE DATABASE `{database}`")
+    cur.execute(f"USE `{database}`")
+    for statement in SCHEMA.read_text().split(';'):
+        lines = [line for line in statement.splitlines() if not line.strip().startswith('--')]
+        if '\n'.join(lines).strip():
+            cur.execute('\n'.join(lines))
+    conn.commit()
+    cur.close()
+    return conn
+
+def insert_batches(conn, sql, rows):
+    cur = conn.cursor()
+    for start in range(0, len(rows), BATCH_SIZE):
+        cur.executemany(sql, rows[start:start + BATCH_SIZE])
+    conn.commit()
+    cur.close()
+
+def seed(artworks, users, carts, orders, seed_value=42):
+    rng = random.Random(seed_value)
+    conn = create_schema()
+    now = datetime(2025, 1, 1)
+
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+    user_rows = []
+    for i in range(1, users + 1):
+        role = 'artist' if i % 20 == 0 else 'customer'
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        user_rows.append((role, f'user{i}', password_hash, f'user{i}@bench.example', first, last,
+                          '+15550000000', '1 Bench Street', 'Sydney', 'NSW', '2000', 'Australia'))
+    insert_batches(conn, """
+        INSERT INTO users (role, username, password_hash, email, firstname, lastname,
+                           phone, address, city, state, zip, country)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, user_rows)
+    artist_ids = [i for i in range(1, users + 1) if i % 20 == 0] or [1]
+
+    artwork_rows = []
+    for i in range(artworks):
+        noun, medium = rng.choice(NOUNS), rng.choice(MEDIUMS)
+        artist_id = rng.choice(artist_ids)
+        artwork_rows.append((
+            f'{rng.choice(ADJECTIVES)} {noun} {i}', f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}', artist_id,
+            rng.choice(DESCRIPTIONS).format(noun=noun.lower(), medium=medium.lower()), medium,
+            f'{rng.randint(8, 48)}x{rng.randint(8, 60)} inches', round(rng.lognormvariate(6.2, 0.6), 2),
+            rng.choice(IMAGES), 'available' if rng.random() > 0.1 else 'sold',
+            now - timedelta(minutes=rng.randint(0, 60 * 24 * 730)),
+        ))
+    insert_batches(conn, """
+        INSERT INTO artworks (title, artist_name, artist_id, description, medium, dimensions,
+                              price, image_url, status, created_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, artwork_rows)
+
+    cart_rows = {(rng.randint(1, users), rng.randint(1, artworks)) for _ in range(carts)}
+    insert_batches(conn, "INSERT INTO cart (user_id, artwork_id) VALUES (%s, %s)", sorted(cart_rows))
+
+    cur = conn.cursor()
+    cur.execute("UPDATE catalog_version SET version = version + 1 WHERE id = 1")
+    for _ in range(orders):
+        user_id = rng.randint(1, users)
+        items = [(rng.randint(1, artworks), round(rng.lognormvariate(6.2, 0.6), 2)) for _ in range(rng.randint(1, 3))]
+        subtotal = sum(price for _, price in items)
+        cur.execute("""
+            INSERT INTO orders (user_id, total_amount, shipping_cost, tax, status, shipping_address,
+                                payment_method, created_at)
+            VALUES (%s, %s, 45.00, %s, 'delivered', '1 Bench Street', 'credit_card', %s)
+        """, (user_id, round(subtotal * 1.08 + 45, 2), round(subtotal * 0.08, 2),
+              now - timedelta(minutes=rng.randint(0, 60 * 24 * 365))))
+        order_id = cur.lastrowid
+        cur.executemany("INSERT INTO order_items (order_id, artwork_id, price, quantity) VALUES (%s, %s, %s, 1)",
+                        [(order_id, artwork_id, price) for artwork_id, price in items])
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    # The dashboards read the sales rollups, which only checkout maintains.
+    from project.sales import rebuild_sales
+    with bench_app().app_context():
+        rebuild_sales()
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed the benchmark database.')
+    parser.add_argument('--artworks', type=int, default=50000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--carts', type=int, default=5000)
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    started = time.perf_counter()
+    seed(args.artworks, args.users, args.carts, args.orders, args.seed)
+    print(f"Seeded {BENCH_CONFIG['MYSQL_DB']}: {args.artworks} artworks, {args.users} users, "
+          f"{args.carts} cart rows, {args.orders} orders in {time.perf_counter() - started:.1f}s")
+
+if __name__ == '__main__':
+    main()
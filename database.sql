@@ -31,12 +31,36 @@ CREATE TABLE artworks (
     FOREIGN KEY (artist_id) REFERENCES users(id)
 );
 
+-- Single row, bumped in the same transaction as every change to artworks.
+-- Catalog pages derive their ETag and Last-Modified headers from it.
+CREATE TABLE catalog_version (
+    id TINYINT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    -- catalog_changes holds nothing at or below this version any more.
+    pruned_through BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO catalog_version (id, version) VALUES (1, 0);
+
+-- The artworks each catalog version changed, written in the same transaction
+-- as the bump. Workers replay it to update their in-memory read models;
+-- `flask jobs purge` deletes old entries.
+CREATE TABLE catalog_changes (
+    version BIGINT NOT NULL,
+    artwork_id INT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (version, artwork_id),
+    INDEX idx_catalog_changes_created (created_at)
+);
+
 CREATE TABLE cart (
     id INT AUTO_INCREMENT PRIMARY KEY,
     user_id INT NOT NULL,
     artwork_id INT NOT NULL,
     quantity INT DEFAULT 1,
     added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY uq_cart_user_artwork (user_id, artwork_id),
     FOREIGN KEY (user_id) REFERENCES users(id),
     FOREIGN KEY (artwork_id) REFERENCES artworks(id)
 );
@@ -62,4 +86,83 @@ CREATE TABLE order_items (
     quantity INT DEFAULT 1,
     FOREIGN KEY (order_id) REFERENCES orders(id),
     FOREIGN KEY (artwork_id) REFERENCES artworks(id)
-);
\ No newline at end of file
+);
+
+-- Catalog browsing indexes. Each one matches a sort offered by
+-- get_artworks_page (status filter, sort key, id tie-breaker), so a page is a
+-- short range scan no matter how large the catalog grows.
+CREATE INDEX idx_artworks_status_created ON artworks (status, created_at, id);
+CREATE INDEX idx_artworks_status_price ON artworks (status, price, id);
+CREATE INDEX idx_artworks_status_id ON artworks (status, id);
+
+-- Order history: a user's orders newest first (see get_order_history).
+CREATE INDEX idx_orders_user_created ON orders (user_id, created_at, id);
+
+-- Sales rollups, maintained by create_order (see project/sales.py) and
+-- rebuilt from orders with `flask sales rebuild`.
+CREATE TABLE sales_by_artwork (
+    artwork_id INT PRIMARY KEY,
+    artist_id INT,
+    units INT NOT NULL,
+    revenue DECIMAL(14, 2) NOT NULL,
+    orders INT NOT NULL,
+    last_sold_at TIMESTAMP NULL,
+    INDEX idx_sales_by_artwork_artist (artist_id, last_sold_at),
+    INDEX idx_sales_by_artwork_revenue (revenue),
+    FOREIGN KEY (artwork_id) REFERENCES artworks(id)
+);
+
+CREATE TABLE sales_by_artist (
+    artist_id INT NOT NULL,
+    day DATE NOT NULL,
+    units INT NOT NULL,
+    revenue DECIMAL(14, 2) NOT NULL,
+    orders INT NOT NULL,
+    PRIMARY KEY (artist_id, day),
+    FOREIGN KEY (artist_id) REFERENCES users(id)
+);
+
+CREATE TABLE sales_by_day (
+    day DATE NOT NULL,
+    slot TINYINT NOT NULL,
+    units INT NOT NULL,
+    revenue DECIMAL(14, 2) NOT NULL,
+    orders INT NOT NULL,
+    PRIMARY KEY (day, slot)
+);
+
+-- Bulk imports (see project/importer.py). rows_processed is the checkpoint:
+-- it advances in the same transaction as each chunk of inserted artworks.
+CREATE TABLE artwork_imports (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT,
+    source VARCHAR(255) NOT NULL,
+    format VARCHAR(10) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'running',
+    rows_processed INT NOT NULL DEFAULT 0,
+    rows_inserted INT NOT NULL DEFAULT 0,
+    rows_rejected INT NOT NULL DEFAULT 0,
+    -- JSON list of [record number, problem], the first 100 only.
+    errors TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    INDEX idx_artwork_imports_user (user_id, created_at),
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+-- Background jobs (see project/jobs.py). run_at is when a queued job is due,
+-- and for a running job when its worker's lease expires.
+CREATE TABLE jobs (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    payload TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    attempts INT NOT NULL DEFAULT 0,
+    max_attempts INT NOT NULL DEFAULT 5,
+    run_at DATETIME NOT NULL,
+    locked_by VARCHAR(100),
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    INDEX idx_jobs_ready (status, run_at)
+);
@@ -1,25 +1,56 @@
+import os
+import time
 from flask import Flask, render_template
 from flask_bootstrap import Bootstrap5
-from flask_mysqldb import MySQL
 from flask_login import LoginManager
+from project.cache import catalog_cache, user_cache, cart_count_cache, platform_counts_cache
+from project.pool import MySQLPool
+from project.availability import availability
+from project.hashing import password_hasher
+from project import fragments, httpcache, images, metrics
 
-mysql = MySQL()
+mysql = MySQLPool()
 login_manager = LoginManager()
 
-def create_app():
+def create_app(config=None):
+    started = time.perf_counter()
     app = Flask(__name__)
-    app.debug = True
-    app.secret_key = 'Admin123'
+    # ARTSPACE_PROFILE=production: no debugger, secret key from the
+    # environment, templates precompiled and caches warmed before serving.
+    app.config['PROFILE'] = (config or {}).get('PROFILE') or os.environ.get('ARTSPACE_PROFILE', 'development')
+    production = app.config['PROFILE'] == 'production'
+    app.debug = not production
+    app.secret_key = os.environ.get('SECRET_KEY') if production else 'Admin123'
 
     app.config['MYSQL_HOST'] = 'localhost' #replace with your mysql host
     app.config['MYSQL_USER'] = 'root' #replace with your mysql user
     app.config['MYSQL_PASSWORD'] = '' #replace with your mysql password
     app.config['MYSQL_DB'] = 'artspace' #create a database name artspace for consistency
     app.config['MYSQL_CURSORCLASS'] = 'DictCursor'
+    app.config['MYSQL_POOL_SIZE'] = 10 # connections kept per worker process
+    app.config['MYSQL_POOL_TIMEOUT'] = 5 # seconds a request waits for a free connection
+    app.config['MYSQL_REPLICAS'] = [] # read replicas, e.g. [{'MYSQL_HOST': 'replica-1'}]
+    app.config['METRICS_ENABLED'] = False # set True to record timings and serve /metrics
+    app.config['MAIL_SERVER'] = 'localhost' #replace with your smtp host
+    app.config['MAIL_DEFAULT_SENDER'] = 'ArtSpace <no-reply@artspace.local>'
+    app.config['JOBS_WORKERS'] = 2 # background job threads per worker process; 0 to run `flask jobs work` instead
+    app.config.update(config or {})
+    if production and not app.secret_key:
+        raise RuntimeError('SECRET_KEY must be set in the production profile')
 
     # Initialize Flask extensions
     mysql.init_app(app)
     bootstrap = Bootstrap5(app)
+    catalog_cache.init_app(app)
+    metrics.init_app(app)
+    images.init_app(app)
+    httpcache.init_app(app)
+    fragments.init_app(app)
+    password_hasher.init_app(app)
+    user_cache.configure(app.config.get('USER_CACHE_SIZE', 10000), app.config.get('USER_CACHE_TTL', 300))
+    cart_count_cache.configure(app.config.get('CART_COUNT_CACHE_SIZE', 10000), app.config.get('CART_COUNT_CACHE_TTL', 30))
+    platform_counts_cache.configure(1, app.config.get('PLATFORM_COUNTS_CACHE_TTL', 60))
+    availability.configure(app.config.get('AVAILABILITY_FILTER_CAPACITY', 1000000))
 
     login_manager.init_app(app)
     login_manager.login_view = 'main.login'
@@ -29,6 +60,13 @@ def create_app():
     from . import views
     app.register_blueprint(views.main)
 
+    # Background jobs, their handlers and CLI commands
+    from . import importer, jobs, notifications, sales
+    jobs.job_workers.init_app(app)
+    notifications.init_app(app)
+    importer.init_app(app)
+    sales.init_app(app)
+
     # Error Handlers
     @app.errorhandler(404) 
     def not_found(e):
@@ -42,15 +80,23 @@ def create_app():
     from . import session
     
     # Context processor for templates
+    # Values are lazy: nothing is queried unless a template actually uses it,
+    # and then at most once per request.
+    from flask_login import current_user
+    from werkzeug.local import LocalProxy
+    from .db import get_order_count
+    from .session import session_cart_count
+    from .wrappers import request_memoized
+    cart_count_for = request_memoized(session_cart_count)
+    order_count_for = request_memoized(get_order_count)
+    cart_count = LocalProxy(lambda: cart_count_for(current_user.id) if current_user.is_authenticated else 0)
+
     @app.context_processor
     def inject_user():
-        from flask_login import current_user
-        from .db import get_cart_count, get_user_orders
-        cart_count = 0
-        user_orders = []
-        if current_user.is_authenticated:
-            cart_count = get_cart_count(current_user.id)
-            user_orders = get_user_orders(current_user.id)
-        return dict(current_user=current_user, get_cart_count=get_cart_count, get_user_orders=get_user_orders)
-    
+        return dict(current_user=current_user, cart_count=cart_count,
+                    get_cart_count=cart_count_for, get_order_count=order_count_for)
+
+    if production:
+        from .startup import prepare
+        prepare(app, started)
     return app
\ No newline at end of file
@@ -0,0 +1,103 @@
+import hashlib
+import math
+import threading
+
+# Username/email availability for registration. A Bloom filter per field
+# answers "definitely free" from memory; only possible hits go to MySQL, as a
+# single EXISTS query covering both fields. The filters are loaded once per
+# process and fed by create_user / update_user_profile. Stale extra entries
+# only cost an occasional query; a name registered through another process
+# since the load can slip past the form, in which case the users table's
+# unique keys still reject the INSERT.
+
+class BloomFilter:
+    def __init__(self, capacity=1000000, error_rate=0.01):
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, key):
+        # Double hashing: k positions from the two halves of one digest.
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+def normalize(value):
+    # MySQL compares these columns case-insensitively and ignores trailing spaces.
+    return value.strip().lower() if value else None
+
+class AvailabilityChecker:
+    def __init__(self, capacity=1000000, error_rate=0.01):
+        self._lock = threading.Lock()
+        # Held for a whole load, so concurrent first checks share one scan;
+        # add() only needs _lock and isn't held up by it.
+        self._load_lock = threading.Lock()
+        self.configure(capacity, error_rate)
+
+    def configure(self, capacity, error_rate=0.01):
+        with self._lock:
+            self.capacity = capacity
+            self.error_rate = error_rate
+            self.usernames = BloomFilter(capacity, error_rate)
+            self.emails = BloomFilter(capacity, error_rate)
+            self._pending = None
+            self.loaded = False
+
+    def load(self, identities):
+        usernames = BloomFilter(self.capacity, self.error_rate)
+        emails = BloomFilter(self.capacity, self.error_rate)
+        pending = []
+        with self._lock:
+            self._pending = pending
+        for username, email in identities:
+            usernames.add(normalize(username))
+            emails.add(normalize(email))
+        with self._lock:
+            # Registrations that happened while the load was running.
+            for username, email in pending:
+                if username:
+                    usernames.add(username)
+                if email:
+                    emails.add(email)
+            if self._pending is pending:
+                self._pending = None
+            self.usernames, self.emails = usernames, emails
+            self.loaded = True
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            with self._load_lock:
+                if not self.loaded:
+                    from project.db import iter_user_identities
+                    self.load(iter_user_identities())
+        return self
+
+    def add(self, username=None, email=None):
+        username, email = normalize(username), normalize(email)
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((username, email))
+            if username:
+                self.usernames.add(username)
+            if email:
+                self.emails.add(email)
+
+    def check(self, username, email):
+        # Returns (username_taken, email_taken).
+        from project.db import users_exist
+        self.ensure_loaded()
+        maybe_username = normalize(username) in self.usernames if username else False
+        maybe_email = normalize(email) in self.emails if email else False
+        if not (maybe_username or maybe_email):
+            return False, False
+        return users_exist(username if maybe_username else None, email if maybe_email else None)
+
+availability = AvailabilityChecker()
@@ -0,0 +1,130 @@
+import threading
+import time
+from collections import OrderedDict
+from project.signals import artwork_changed, catalog_synced
+
+# Per-process read-through caches for catalog data. Artwork rows change rarely
+# compared with how often they are read, so the catalog and detail pages are
+# served from here and only fall through to MySQL on a miss. Every write to
+# `artworks` invalidates explicitly through the catalog signals, including
+# writes made by other processes once they are synced (see httpcache).
+
+_MISSING = object()
+
+class LRUCache:
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, maxsize, ttl=None):
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_load(self, key, loader):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            # Misses (None) are not remembered, so a new artwork shows up as
+            # soon as it exists.
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data), 'maxsize': self.maxsize}
+
+class NullCache(LRUCache):
+    # Drop-in backend that never stores anything, for CATALOG_CACHE_TYPE = 'null'.
+    def set(self, key, value):
+        pass
+
+CACHE_BACKENDS = {'simple': LRUCache, 'null': NullCache}
+
+class CatalogCache:
+    def __init__(self):
+        self.configure()
+
+    def configure(self, backend='simple', artwork_size=4096, artwork_ttl=300, listing_size=256, listing_ttl=60):
+        cache_class = CACHE_BACKENDS[backend]
+        self.artworks = cache_class(maxsize=artwork_size, ttl=artwork_ttl)
+        self.listings = cache_class(maxsize=listing_size, ttl=listing_ttl)
+
+    def init_app(self, app):
+        self.configure(backend=app.config.get('CATALOG_CACHE_TYPE', 'simple'),
+                       artwork_size=app.config.get('CATALOG_CACHE_SIZE', 4096),
+                       artwork_ttl=app.config.get('CATALOG_CACHE_TTL', 300),
+                       listing_size=app.config.get('CATALOG_LISTING_CACHE_SIZE', 256),
+                       listing_ttl=app.config.get('CATALOG_LISTING_CACHE_TTL', 60))
+
+    def invalidate_artwork(self, artwork_id):
+        self.artworks.delete(artwork_id)
+        self.listings.clear()
+
+    def clear(self):
+        self.artworks.clear()
+        self.listings.clear()
+
+    def stats(self):
+        return {'artworks': self.artworks.stats(), 'listings': self.listings.stats()}
+
+catalog_cache = CatalogCache()
+
+# Session users by id, as (version, SessionUser). See db.get_session_user.
+user_cache = LRUCache(maxsize=10000, ttl=300)
+
+# Cart badge counts by user id, as (version, count). See db.get_cart_count.
+cart_count_cache = LRUCache(maxsize=10000, ttl=30)
+
+# Head counts (users, artists, listed artworks) for the admin dashboard; not
+# worth two table scans per page view, and a minute behind is fine.
+platform_counts_cache = LRUCache(maxsize=1, ttl=60)
+
+@artwork_changed.connect
+def _on_artwork_changed(sender, artwork_id, **extra):
+    catalog_cache.invalidate_artwork(artwork_id)
+
+@catalog_synced.connect
+def _on_catalog_synced(sender, artworks, **extra):
+    if artworks is None:
+        catalog_cache.clear()
+        return
+    for artwork in artworks:
+        catalog_cache.artworks.delete(artwork['id'])
+    catalog_cache.listings.clear()
@@ -1,22 +1,32 @@
+import base64
+from datetime import datetime
+from decimal import Decimal
 from project import mysql
-from project.models import User
-from werkzeug.security import generate_password_hash
+from project.availability import availability
+from project.cache import catalog_cache, user_cache, cart_count_cache
+from project.models import User, SessionUser, ArtworkPage, OrderPage
+from project.signals import artwork_changed
+from project.hashing import password_hasher
+from project.metrics import instrument
+from project.sales import record_sale
+from project.jobs import enqueue, job_workers
 
 # Authentication and User Management Functions
 def create_user(form, role):
     cur = mysql.connection.cursor()
     try:
-        hashed_password = generate_password_hash(form.password.data)
+        hashed_password = password_hasher.hash(form.password.data)
         cur.execute("""
             INSERT INTO users (role, username, firstname, lastname, email, password_hash)
             VALUES (%s, %s, %s, %s, %s, %s)
         """, (role, form.username.data, form.firstname.data, form.lastname.data, form.email.data, hashed_password))
-        mysql.connection.commit()
+        mysql.commit()
     except Exception as e:
         mysql.connection.rollback()
         raise e
     finally:
         cur.close()
+    availability.add(form.username.data, form.email.data)
 
 def get_user_by_username(username):
     cur = mysql.connection.cursor()
@@ -33,7 +43,7 @@ def get_user_by_username(username):
     return None
 
 def get_user_by_id(user_id):
-    cur = mysql.connection.cursor()
+    cur = mysql.read_connection.cursor()
     cur.execute("SELECT * FROM users WHERE id = %s", (user_id,))
     row = cur.fetchone()
     cur.close()
@@ -46,19 +56,59 @@ def get_user_by_id(user_id):
         )
     return None
 
-def check_username(username):
+def update_password_hash(user_id, password_hash):
     cur = mysql.connection.cursor()
-    cur.execute("SELECT * FROM users WHERE username = %s", (username,))
+    try:
+        cur.execute("UPDATE users SET password_hash = %s WHERE id = %s", (password_hash, user_id))
+        mysql.commit()
+    except Exception as e:
+        mysql.connection.rollback()
+        raise e
+    finally:
+        cur.close()
+
+# Loaded for every authenticated request, so it is cached per process. The
+# version comes from the user's own session cookie and changes whenever they
+# edit their profile, so their edits are visible on any worker right away;
+# the cache TTL bounds staleness for changes made by anyone else.
+SESSION_USER_COLUMNS = "id, role, username, firstname, lastname, email, phone, address, city, state, zip, country"
+
+def get_session_user(user_id, version=None):
+    cached = user_cache.get(user_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    cur = mysql.read_connection.cursor()
+    cur.execute(f"SELECT {SESSION_USER_COLUMNS} FROM users WHERE id = %s", (user_id,))
     row = cur.fetchone()
     cur.close()
-    return True if row else False
+    if not row:
+        user_cache.delete(user_id)
+        return None
+    user = SessionUser(**row)
+    user_cache.set(user_id, (version, user))
+    return user
 
-def check_email(email):
+def users_exist(username, email):
+    # Both lookups in one round trip; each is a unique-index probe.
     cur = mysql.connection.cursor()
-    cur.execute("SELECT * FROM users WHERE email = %s", (email,))
+    cur.execute("""
+        SELECT EXISTS(SELECT 1 FROM users WHERE username = %s) AS username_taken,
+               EXISTS(SELECT 1 FROM users WHERE email = %s) AS email_taken
+    """, (username, email))
     row = cur.fetchone()
     cur.close()
-    return True if row else False
+    return bool(row['username_taken']), bool(row['email_taken'])
+
+def iter_user_identities(batch_size=10000):
+    cur = mysql.read_connection.cursor()
+    cur.execute("SELECT username, email FROM users")
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            yield row['username'], row['email']
+    cur.close()
 
 def update_user_profile(user_id, form):
     cur = mysql.connection.cursor()
@@ -78,51 +128,270 @@ def update_user_profile(user_id, form):
             WHERE id = %s
         """, (form.firstname.data, form.lastname.data, form.email.data,
               phone_data, bio_data,  address_data, city_data, state_data, zip_data, country_data, user_id))
-        mysql.connection.commit()
+        mysql.commit()
     except Exception as e:
         mysql.connection.rollback()
         raise e
     finally:
         cur.close()
+    user_cache.delete(user_id)
+    availability.add(email=form.email.data)
 
-def get_all_artworks():
-    cur = mysql.connection.cursor()
-    cur.execute("SELECT * FROM artworks WHERE status = 'available'")
-    artworks = cur.fetchall()
+# Catalog pagination
+# Keyset ("seek") pagination: each page continues from the sort key of the last
+# row served instead of using OFFSET, so the cost of a page does not grow with
+# how deep into the catalog the visitor is. Every sort carries id as the
+# tie-breaker so the ordering is total and cursors are stable.
+ARTWORK_SORTS = {
+    'newest': ('created_at', 'DESC'),
+    'price_asc': ('price', 'ASC'),
+    'price_desc': ('price', 'DESC'),
+    'id': ('id', 'ASC'),
+}
+DEFAULT_ARTWORK_SORT = 'newest'
+ARTWORK_GRID_COLUMNS = "id, title, artist_name, medium, dimensions, price, image_url, created_at"
+
+# Page cursors are the keyset values joined with '|', base64url without padding.
+def _pack_cursor(*values):
+    return base64.urlsafe_b64encode('|'.join(map(str, values)).encode()).decode().rstrip('=')
+
+def _unpack_cursor(cursor):
+    # Raises ValueError for anything that isn't a cursor we made.
+    return base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+
+def _encode_cursor(row, sort):
+    column = ARTWORK_SORTS[sort][0]
+    return _pack_cursor(row['id']) if column == 'id' else _pack_cursor(row[column], row['id'])
+
+def _decode_cursor(cursor, sort):
+    column = ARTWORK_SORTS[sort][0]
+    try:
+        raw = _unpack_cursor(cursor)
+        if column == 'id':
+            return (int(raw),)
+        value, row_id = raw.rsplit('|', 1)
+        if column == 'price':
+            value = Decimal(value)
+            if not value.is_finite():
+                return None
+        else:
+            value = datetime.fromisoformat(value)
+        return (value, int(row_id))
+    except (ValueError, ArithmeticError):
+        return None
+
+def get_artworks_page(sort=DEFAULT_ARTWORK_SORT, after=None, before=None, limit=24):
+    if sort not in ARTWORK_SORTS:
+        sort = DEFAULT_ARTWORK_SORT
+    return catalog_cache.listings.get_or_load(
+        ('page', sort, after, before, limit),
+        lambda: _fetch_artworks_page(sort, after, before, limit))
+
+def _fetch_artworks_page(sort, after, before, limit):
+    column, direction = ARTWORK_SORTS[sort]
+    # Paging backwards walks the same index in the opposite direction and
+    # flips the rows afterwards.
+    backwards = before is not None and after is None
+    key = _decode_cursor(before if backwards else after, sort) if (before or after) else None
+    if backwards and key is None:
+        backwards = False
+    forward = (direction == 'ASC') != backwards
+    op, order = ('>', 'ASC') if forward else ('<', 'DESC')
+
+    where = ["status = 'available'"]
+    params = []
+    if key is not None:
+        if column == 'id':
+            where.append(f"id {op} %s")
+            params.append(key[0])
+        else:
+            where.append(f"({column} {op} %s OR ({column} = %s AND id {op} %s))")
+            params.extend([key[0], key[0], key[1]])
+    order_by = "id " + order if column == 'id' else f"{column} {order}, id {order}"
+
+    cur = mysql.read_connection.cursor()
+    cur.execute(f"""
+        SELECT {ARTWORK_GRID_COLUMNS}
+        FROM artworks
+        WHERE {' AND '.join(where)}
+        ORDER BY {order_by}
+        LIMIT %s
+    """, (*params, limit + 1))
+    rows = list(cur.fetchall())
     cur.close()
-    return artworks
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+
+    page = ArtworkPage(items=rows, sort=sort, limit=limit)
+    if rows:
+        # Going backwards, "more" means more pages before this one; there is
+        # always a page after it (the one we came from).
+        if has_more or backwards:
+            page.next_cursor = _encode_cursor(rows[-1], sort)
+        if has_more if backwards else key is not None:
+            page.prev_cursor = _encode_cursor(rows[0], sort)
+    return page
 
 def get_artwork_by_id(artwork_id):
-    cur = mysql.connection.cursor()
+    return catalog_cache.artworks.get_or_load(artwork_id, lambda: _fetch_artwork(artwork_id))
+
+def _fetch_artwork(artwork_id):
+    cur = mysql.read_connection.cursor()
     cur.execute("SELECT * FROM artworks WHERE id = %s", (artwork_id,))
     artwork = cur.fetchone()
     cur.close()
     return artwork
 
+def iter_available_artworks(batch_size=10000):
+    cur = mysql.read_connection.cursor()
+    cur.execute(f"SELECT {ARTWORK_GRID_COLUMNS} FROM artworks WHERE status = 'available'")
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        yield from rows
+    cur.close()
+
+def get_searchable_artworks():
+    cur = mysql.read_connection.cursor()
+    cur.execute(f"SELECT {ARTWORK_GRID_COLUMNS}, description FROM artworks WHERE status = 'available'")
+    artworks = cur.fetchall()
+    cur.close()
+    return artworks
+
+def get_image_urls():
+    cur = mysql.read_connection.cursor()
+    cur.execute("SELECT DISTINCT image_url FROM artworks WHERE image_url IS NOT NULL")
+    urls = [row['image_url'] for row in cur.fetchall()]
+    cur.close()
+    return urls
+
+# Every write to artworks bumps the catalog version in the same transaction
+# and logs the artworks it changed under the new version. The version is what
+# the catalog pages' ETag and Last-Modified headers are built from; the log is
+# how other processes catch up (see httpcache.CatalogVersion). The bump takes
+# the catalog_version row lock, so versions commit in order.
+def bump_catalog_version(cur, artwork_ids):
+    cur.execute("UPDATE catalog_version SET version = version + 1 WHERE id = 1")
+    cur.execute("SELECT version FROM catalog_version WHERE id = 1")
+    version = cur.fetchone()['version']
+    artwork_ids = list(dict.fromkeys(artwork_ids))
+    if artwork_ids:
+        cur.execute(f"""
+            INSERT INTO catalog_changes (version, artwork_id)
+            VALUES {', '.join(['(%s, %s)'] * len(artwork_ids))}
+        """, [value for artwork_id in artwork_ids for value in (version, artwork_id)])
+    return version
+
+# Read from the primary: a lagging replica would report versions going
+# backwards and forwards.
+def get_catalog_version():
+    cur = mysql.connection.cursor()
+    cur.execute("SELECT version, UNIX_TIMESTAMP(updated_at) AS updated_at FROM catalog_version WHERE id = 1")
+    row = cur.fetchone()
+    cur.close()
+    return row['version'], int(row['updated_at'])
+
+def get_catalog_changes(after, upto, batch_size=1000):
+    # Current rows (with status) of the artworks changed by versions in
+    # (after, upto], or None when those versions have been pruned.
+    cur = mysql.connection.cursor()
+    cur.execute("SELECT pruned_through FROM catalog_version WHERE id = 1")
+    if cur.fetchone()['pruned_through'] > after:
+        cur.close()
+        return None
+    cur.execute("""
+        SELECT DISTINCT artwork_id FROM catalog_changes
+        WHERE version > %s AND version <= %s
+    """, (after, upto))
+    artwork_ids = [row['artwork_id'] for row in cur.fetchall()]
+    artworks = []
+    for start in range(0, len(artwork_ids), batch_size):
+        batch = artwork_ids[start:start + batch_size]
+        cur.execute(f"""
+            SELECT {ARTWORK_GRID_COLUMNS}, description, status FROM artworks
+            WHERE id IN ({', '.join(['%s'] * len(batch))})
+        """, batch)
+        artworks.extend(cur.fetchall())
+    cur.close()
+    return artworks
+
+def prune_catalog_changes(before):
+    # Deletes the change log up to the last version recorded before `before`.
+    # A worker that hasn't synced since then reloads its catalog instead.
+    cur = mysql.connection.cursor()
+    try:
+        cur.execute("SELECT MAX(version) AS version FROM catalog_changes WHERE created_at < %s", (before,))
+        version = cur.fetchone()['version']
+        count = 0
+        if version is not None:
+            # updated_at is the catalog's Last-Modified; pruning changes nothing visible.
+            cur.execute("""
+                UPDATE catalog_version
+                SET pruned_through = GREATEST(pruned_through, %s), updated_at = updated_at
+                WHERE id = 1
+            """, (version,))
+            cur.execute("DELETE FROM catalog_changes WHERE version <= %s", (version,))
+            count = cur.rowcount
+        mysql.commit()
+    except Exception as e:
+        mysql.connection.rollback()
+        raise e
+    finally:
+        cur.close()
+    return count
+
+# Cart writes are single upserts against the (user_id, artwork_id) unique key,
+# so concurrent clicks can never create duplicate rows. Only artworks that are
+# still available are added; the return value says whether anything was.
 def add_to_cart(user_id, artwork_id):
     cur = mysql.connection.cursor()
     try:
-        cur.execute("SELECT * FROM cart WHERE user_id = %s AND artwork_id = %s", (user_id, artwork_id))
-        existing = cur.fetchone()
-        
-        if existing:
-            cur.execute("UPDATE cart SET quantity = quantity + 1 WHERE user_id = %s AND artwork_id = %s",
-                       (user_id, artwork_id))
-        else:
-            cur.execute("INSERT INTO cart (user_id, artwork_id) VALUES (%s, %s)", (user_id, artwork_id))
-        mysql.connection.commit()
-        return True
+        cur.execute("""
+            INSERT INTO cart (user_id, artwork_id)
+            SELECT %s, id FROM artworks WHERE id = %s AND status = 'available'
+            ON DUPLICATE KEY UPDATE quantity = quantity + 1
+        """, (user_id, artwork_id))
+        added = cur.rowcount > 0
+        mysql.commit()
+        cart_count_cache.delete(user_id)
+        return added
     except Exception as e:
         mysql.connection.rollback()
         return False
     finally:
         cur.close()
 
-def get_cart_items(user_id):
+def add_many_to_cart(user_id, artwork_ids):
+    artwork_ids = list(dict.fromkeys(artwork_ids))
+    if not artwork_ids:
+        return False
     cur = mysql.connection.cursor()
+    try:
+        placeholders = ', '.join(['%s'] * len(artwork_ids))
+        cur.execute(f"""
+            INSERT INTO cart (user_id, artwork_id)
+            SELECT %s, id FROM artworks WHERE id IN ({placeholders}) AND status = 'available'
+            ON DUPLICATE KEY UPDATE quantity = quantity + 1
+        """, (user_id, *artwork_ids))
+        added = cur.rowcount > 0
+        mysql.commit()
+        cart_count_cache.delete(user_id)
+        return added
+    except Exception as e:
+        mysql.connection.rollback()
+        return False
+    finally:
+        cur.close()
+
+def get_cart_items(user_id):
+    cur = mysql.read_connection.cursor()
     cur.execute("""
         SELECT c.id, c.artwork_id, c.quantity, a.title, a.artist_name, 
-               a.price, a.image_url, a.medium, a.dimensions
+               a.price, a.image_url, a.medium, a.dimensions, a.status
         FROM cart c
         JOIN artworks a ON c.artwork_id = a.id
         WHERE c.user_id = %s
@@ -135,7 +404,8 @@ def remove_from_cart(cart_id, user_id):
     cur = mysql.connection.cursor()
     try:
         cur.execute("DELETE FROM cart WHERE id = %s AND user_id = %s", (cart_id, user_id))
-        mysql.connection.commit()
+        mysql.commit()
+        cart_count_cache.delete(user_id)
         return True
     except:
         mysql.connection.rollback()
@@ -143,21 +413,28 @@ def remove_from_cart(cart_id, user_id):
     finally:
         cur.close()
 
-def get_cart_total(user_id):
-    cur = mysql.connection.cursor()
-    cur.execute("""
-        SELECT SUM(a.price * c.quantity) as total
-        FROM cart c
-        JOIN artworks a ON c.artwork_id = a.id
-        WHERE c.user_id = %s
-    """, (user_id,))
-    result = cur.fetchone()
-    cur.close()
-    return result['total'] if result['total'] else 0
+class CartChanged(Exception):
+    # The cart no longer matches the quote the customer agreed to at checkout.
+    pass
 
-def create_order(user_id, total, shipping, tax, address, payment_method):
+def create_order(user_id, total, shipping, tax, address, payment_method, expected_subtotal=None):
     cur = mysql.connection.cursor()
     try:
+        # Lock the cart's artworks (in id order, so two buyers sharing
+        # artworks can't deadlock) until this order commits; a concurrent
+        # buyer of the same original waits here and then sees it sold.
+        cur.execute("""
+            SELECT c.artwork_id, a.status
+            FROM cart c
+            JOIN artworks a ON c.artwork_id = a.id
+            WHERE c.user_id = %s
+            ORDER BY a.id
+            FOR UPDATE
+        """, (user_id,))
+        cart = cur.fetchall()
+        if not cart or any(row['status'] != 'available' for row in cart):
+            raise CartChanged()
+
         cur.execute("""
             INSERT INTO orders (user_id, total_amount, shipping_cost, tax, shipping_address, payment_method)
             VALUES (%s, %s, %s, %s, %s, %s)
@@ -170,32 +447,124 @@ def create_order(user_id, total, shipping, tax, address, payment_method):
             SELECT %s, c.artwork_id, a.price, c.quantity
             FROM cart c
             JOIN artworks a ON c.artwork_id = a.id
-            WHERE c.user_id = %s
+            WHERE c.user_id = %s AND a.status = 'available'
         """, (order_id, user_id))
-        
+        if cur.rowcount != len(cart):
+            raise CartChanged()
+
+        record_sale(cur, order_id)
+
+        if expected_subtotal is not None:
+            cur.execute("SELECT SUM(price * quantity) AS subtotal FROM order_items WHERE order_id = %s", (order_id,))
+            if (cur.fetchone()['subtotal'] or 0) != expected_subtotal:
+                raise CartChanged()
+
+        # Each artwork is an original, so whatever was just bought leaves the catalog.
+        cur.execute("""
+            UPDATE artworks a
+            JOIN order_items oi ON oi.artwork_id = a.id
+            SET a.status = 'sold'
+            WHERE oi.order_id = %s
+        """, (order_id,))
+        cur.execute("SELECT artwork_id FROM order_items WHERE order_id = %s", (order_id,))
+        sold_ids = [row['artwork_id'] for row in cur.fetchall()]
+        version = bump_catalog_version(cur, sold_ids)
+
         cur.execute("DELETE FROM cart WHERE user_id = %s", (user_id,))
-        mysql.connection.commit()
-        return order_id
+        # Follow-up work runs after checkout has returned; the job exists
+        # only if the order does.
+        enqueue(cur, 'orders.send_confirmation', order_id=order_id)
+        mysql.commit()
+        cart_count_cache.delete(user_id)
     except Exception as e:
         mysql.connection.rollback()
         raise e
     finally:
         cur.close()
+    job_workers.wake()
+    for artwork_id in sold_ids:
+        artwork_changed.send(None, artwork_id=artwork_id, status='sold', version=version)
+    return order_id
 
-def get_user_orders(user_id):
-    cur = mysql.connection.cursor()
-    cur.execute("""
-        SELECT * FROM orders 
-        WHERE user_id = %s 
-        ORDER BY created_at DESC
-    """, (user_id,))
-    orders = cur.fetchall()
+ORDER_HISTORY_COLUMNS = "id, total_amount, shipping_cost, tax, status, payment_method, created_at"
+
+def _encode_order_cursor(order):
+    return _pack_cursor(order['created_at'], order['id'])
+
+def _decode_order_cursor(cursor):
+    try:
+        created_at, order_id = _unpack_cursor(cursor).rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(order_id)
+    except ValueError:
+        return None
+
+# Newest first, keyset-paged on (created_at, id) along idx_orders_user_created,
+# so a buyer's hundredth page costs the same as their first. Line items for
+# the whole page come from one more query.
+def get_order_history(user_id, after=None, limit=10):
+    key = _decode_order_cursor(after) if after else None
+    where = "user_id = %s"
+    params = [user_id]
+    if key is not None:
+        where += " AND (created_at < %s OR (created_at = %s AND id < %s))"
+        params.extend([key[0], key[0], key[1]])
+
+    cur = mysql.read_connection.cursor()
+    cur.execute(f"""
+        SELECT {ORDER_HISTORY_COLUMNS}
+        FROM orders
+        WHERE {where}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s
+    """, (*params, limit + 1))
+    orders = list(cur.fetchall())
+    has_more = len(orders) > limit
+    orders = orders[:limit]
+
+    by_id = {}
+    for order in orders:
+        order['items'] = []
+        by_id[order['id']] = order
+    if by_id:
+        cur.execute(f"""
+            SELECT oi.order_id, oi.artwork_id, oi.price, oi.quantity, a.title, a.artist_name, a.image_url
+            FROM order_items oi
+            JOIN artworks a ON a.id = oi.artwork_id
+            WHERE oi.order_id IN ({', '.join(['%s'] * len(by_id))})
+            ORDER BY oi.order_id, oi.id
+        """, tuple(by_id))
+        for item in cur.fetchall():
+            by_id[item['order_id']]['items'].append(item)
     cur.close()
-    return orders
 
-def get_cart_count(user_id):
-    cur = mysql.connection.cursor()
+    page = OrderPage(orders=orders, limit=limit, first=key is None)
+    if has_more:
+        page.next_cursor = _encode_order_cursor(orders[-1])
+    return page
+
+def get_order_count(user_id):
+    cur = mysql.read_connection.cursor()
+    cur.execute("SELECT COUNT(*) AS count FROM orders WHERE user_id = %s", (user_id,))
+    count = cur.fetchone()['count']
+    cur.close()
+    return count
+
+# On every page, for the basket badge. Versioned through the session like
+# get_session_user: the user's own cart changes are visible on any worker
+# right away.
+def get_cart_count(user_id, version=None):
+    cached = cart_count_cache.get(user_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    count = _fetch_cart_count(user_id)
+    cart_count_cache.set(user_id, (version, count))
+    return count
+
+def _fetch_cart_count(user_id):
+    cur = mysql.read_connection.cursor()
     cur.execute("SELECT SUM(quantity) as count FROM cart WHERE user_id = %s", (user_id,))
     result = cur.fetchone()
     cur.close()
-    return result['count'] if result and result['count'] else 0
\ No newline at end of file
+    return result['count'] if result and result['count'] else 0
+
+instrument(globals())
@@ -0,0 +1,140 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+import numpy as np
+from project.readmodel import ColumnarReadModel
+
+# Columnar in-memory copy of the available catalog for faceted browsing:
+# medium and price-range filters plus the counts shown next to them. Each
+# artwork is one position in parallel NumPy arrays, so a filter is a boolean
+# mask and every count is a bincount over it, with no GROUP BY per request.
+
+# Price histogram edges; bucket i is [PRICE_EDGES[i-1], PRICE_EDGES[i]).
+PRICE_EDGES = (100, 250, 500, 1000, 2500, 5000)
+
+@dataclass
+class FacetFilter:
+    mediums: tuple = ()
+    min_price: Decimal = None
+    max_price: Decimal = None   # exclusive
+
+    def __bool__(self):
+        return bool(self.mediums) or self.min_price is not None or self.max_price is not None
+
+    @classmethod
+    def from_args(cls, args):
+        def price(name):
+            try:
+                value = Decimal(args.get(name, ''))
+            except InvalidOperation:
+                return None
+            return value if value.is_finite() and value >= 0 else None
+        mediums = tuple(dict.fromkeys(medium for medium in args.getlist('medium') if medium))
+        return cls(mediums=mediums, min_price=price('min_price'), max_price=price('max_price'))
+
+@dataclass
+class FacetCounts:
+    total: int = 0
+    mediums: list = field(default_factory=list)   # [(medium, count)], largest first
+    prices: list = field(default_factory=list)    # [(low, high, count)]; high None = no upper bound
+
+class FacetIndex(ColumnarReadModel):
+    COLUMNS = {
+        '_ids': (np.int64, (), 0),
+        '_prices': (np.float64, (), 0.0),
+        '_created': (np.float64, (), 0.0),
+        '_medium_codes': (np.int32, (), 0),
+    }
+
+    def _reset(self, capacity=1024):
+        super()._reset(capacity)
+        self._mediums = []      # code -> medium
+        self._medium_codes_by_name = {}
+
+    def _source(self):
+        from project.db import iter_available_artworks
+        return iter_available_artworks()
+
+    def _code(self, medium):
+        medium = medium or 'Other'
+        code = self._medium_codes_by_name.get(medium)
+        if code is None:
+            code = self._medium_codes_by_name[medium] = len(self._mediums)
+            self._mediums.append(medium)
+        return code
+
+    def _add(self, row):
+        position = self._place(row)
+        created_at = row.get('created_at')
+        self._ids[position] = row['id']
+        self._prices[position] = float(row['price'])
+        self._created[position] = created_at.timestamp() if isinstance(created_at, datetime) else 0.0
+        self._medium_codes[position] = self._code(row.get('medium'))
+
+    def _remove(self, artwork_id):
+        self._drop(artwork_id)
+
+    def _masks(self, filters, ids=None):
+        # (base, by_medium, by_price): a facet's own counts ignore its own
+        # filter, so picking "Oil" still shows how many watercolors there are.
+        n = self._size
+        base = self._alive[:n].copy()
+        if ids is not None:
+            base &= np.isin(self._ids[:n], np.fromiter(ids, dtype=np.int64))
+        by_medium = np.ones(n, dtype=bool)
+        if filters.mediums:
+            codes = [self._medium_codes_by_name[m] for m in filters.mediums if m in self._medium_codes_by_name]
+            by_medium = np.isin(self._medium_codes[:n], codes)
+        by_price = np.ones(n, dtype=bool)
+        prices = self._prices[:n]
+        if filters.min_price is not None:
+            by_price &= prices >= float(filters.min_price)
+        if filters.max_price is not None:
+            by_price &= prices < float(filters.max_price)
+        return base, by_medium, by_price
+
+    def counts(self, filters, ids=None):
+        with self._lock:
+            base, by_medium, by_price = self._masks(filters, ids)
+            medium_counts = np.bincount(self._medium_codes[:self._size][base & by_price],
+                                        minlength=len(self._mediums))
+            buckets = np.searchsorted(PRICE_EDGES, self._prices[:self._size][base & by_medium], side='right')
+            price_counts = np.bincount(buckets, minlength=len(PRICE_EDGES) + 1)
+            mediums = sorted(((self._mediums[code], int(count)) for code, count in enumerate(medium_counts) if count),
+                             key=lambda item: (-item[1], item[0]))
+            edges = (0,) + PRICE_EDGES + (None,)
+            prices = [(edges[i], edges[i + 1], int(count)) for i, count in enumerate(price_counts)]
+            return FacetCounts(total=int(np.count_nonzero(base & by_medium & by_price)), mediums=mediums, prices=prices)
+
+    def matching_ids(self, filters, ids=None):
+        with self._lock:
+            base, by_medium, by_price = self._masks(filters, ids)
+            return set(self._ids[:self._size][base & by_medium & by_price].tolist())
+
+    def page(self, filters, sort='newest', limit=24, offset=0):
+        # Returns (rows, total), ordered like the keyset pages (id breaks ties).
+        with self._lock:
+            base, by_medium, by_price = self._masks(filters)
+            positions = np.flatnonzero(base & by_medium & by_price)
+            ids = self._ids[positions]
+            if sort == 'price_asc':
+                order = np.lexsort((ids, self._prices[positions]))
+            elif sort == 'price_desc':
+                order = np.lexsort((-ids, -self._prices[positions]))
+            elif sort == 'id':
+                order = np.argsort(ids, kind='stable')
+            else:
+                order = np.lexsort((-ids, -self._created[positions]))
+            selected = positions[order[offset:offset + limit]]
+            return [self._rows[position] for position in selected], len(positions)
+
+facet_index = FacetIndex()
+
+def facet_counts(filters, ids=None):
+    return facet_index.ensure_loaded().counts(filters, ids)
+
+def facet_page(filters, sort='newest', limit=24, offset=0):
+    return facet_index.ensure_loaded().page(filters, sort=sort, limit=limit, offset=offset)
+
+def facet_matching_ids(filters, ids=None):
+    return facet_index.ensure_loaded().matching_ids(filters, ids)
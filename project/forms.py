@@ -1,7 +1,8 @@
 from flask_wtf import FlaskForm
-from wtforms.fields import SubmitField, StringField, PasswordField, TextAreaField
-from wtforms.validators import InputRequired, Email, Length, Regexp, ValidationError, EqualTo, Optional
-from project.db import check_username, check_email
+from flask_wtf.file import FileField, FileAllowed, FileRequired
+from wtforms.fields import SubmitField, StringField, PasswordField, TextAreaField, SelectField, IntegerField
+from wtforms.validators import InputRequired, Email, Length, Regexp, ValidationError, EqualTo, Optional, NumberRange
+from project.availability import availability
 
 class RegistrationForm(FlaskForm):
     username = StringField('Username', validators=[InputRequired(), Length(min=4, max=25)])
@@ -15,14 +16,34 @@ class RegistrationForm(FlaskForm):
     email = StringField('Email', validators=[InputRequired(), Email(), Length(max=120)])
     submit = SubmitField('Register')
 
+    # Both fields are checked together, once per submission.
+    def taken(self):
+        if getattr(self, '_taken', None) is None:
+            self._taken = availability.check(self.username.data, self.email.data)
+        return self._taken
+
     def validate_username(self, field):
-        if check_username(field.data):
+        if self.taken()[0]:
             raise ValidationError("Username already taken.")
     
     def validate_email(self, field):
-        if check_email(field.data):
+        if self.taken()[1]:
             raise ValidationError("Email already registered.")
 
+    def mark_taken(self):
+        # After the INSERT hit a unique key: another registration took the
+        # username or email since the validators ran. Returns whether either
+        # field got an error.
+        from project.db import users_exist
+        username_taken, email_taken = self._taken = users_exist(self.username.data, self.email.data)
+        if username_taken:
+            self.username.errors.append("Username already taken.")
+        if email_taken:
+            self.email.errors.append("Email already registered.")
+        # Registered through another worker, so not in this one's filter yet.
+        availability.add(self.username.data if username_taken else None, self.email.data if email_taken else None)
+        return any(self._taken)
+
 class ArtistRegistrationForm(RegistrationForm):
     submit = SubmitField('Register as Artist')
 
@@ -47,4 +68,13 @@ class ProfileForm(FlaskForm):
     country = StringField('Country (Optional)', validators=[Optional(), Length(max=100)])
     submit = SubmitField('Update Profile')
 
-# Forms to handle Order, Checkout, Upload, Edit, Remove Artworks
\ No newline at end of file
+class ArtworkImportForm(FlaskForm):
+    file = FileField('CSV or JSON Lines file', validators=[
+        FileRequired(), FileAllowed(['csv', 'jsonl', 'ndjson', 'json'], 'Upload a .csv or .jsonl file.')
+    ])
+    format = SelectField('Format', choices=[('', 'From file extension'), ('csv', 'CSV'), ('jsonl', 'JSON Lines')],
+                         validators=[Optional()])
+    resume = IntegerField('Resume import # (Optional)', validators=[Optional(), NumberRange(min=1)])
+    submit = SubmitField('Import Artworks')
+
+# Forms to handle Order, Checkout, Edit, Remove Artworks
\ No newline at end of file
@@ -0,0 +1,82 @@
+import threading
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from project.cache import CACHE_BACKENDS
+from project.signals import artwork_changed, catalog_synced
+
+# Rendered template fragments, for markup that is the same for every visitor:
+#
+#   {% cache 'artwork-tile', artwork.id %} ... {% endcache %}
+#
+# Each fragment name gets its own bounded LRU keyed by artwork id. A change to
+# an artwork, made here or synced from another worker (see httpcache), drops
+# its fragments under every name.
+
+class FragmentCache:
+    def __init__(self):
+        self._regions = {}
+        self._lock = threading.Lock()
+        self.configure()
+
+    def configure(self, backend='simple', maxsize=4096, ttl=300):
+        with self._lock:
+            self.cache_class = CACHE_BACKENDS[backend]
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self._regions = {}
+
+    def region(self, name):
+        region = self._regions.get(name)
+        if region is None:
+            with self._lock:
+                region = self._regions.setdefault(name, self.cache_class(maxsize=self.maxsize, ttl=self.ttl))
+        return region
+
+    def get_or_render(self, name, key, render):
+        return self.region(name).get_or_load(key, render)
+
+    def invalidate(self, key):
+        for region in list(self._regions.values()):
+            region.delete(key)
+
+    def clear(self):
+        for region in list(self._regions.values()):
+            region.clear()
+
+    def stats(self):
+        return {name: region.stats() for name, region in self._regions.items()}
+
+fragment_cache = FragmentCache()
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        name = parser.parse_expression()
+        parser.stream.expect('comma')
+        key = parser.parse_expression()
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', [name, key]), [], [], body).set_lineno(lineno)
+
+    def _render(self, name, key, caller):
+        return Markup(fragment_cache.get_or_render(name, key, caller))
+
+def init_app(app):
+    fragment_cache.configure(backend=app.config.get('CATALOG_CACHE_TYPE', 'simple'),
+                             maxsize=app.config.get('FRAGMENT_CACHE_SIZE', 4096),
+                             ttl=app.config.get('FRAGMENT_CACHE_TTL', 300))
+    app.jinja_env.add_extension(FragmentCacheExtension)
+
+@artwork_changed.connect
+def _on_artwork_changed(sender, artwork_id, **extra):
+    fragment_cache.invalidate(artwork_id)
+
+@catalog_synced.connect
+def _on_catalog_synced(sender, artworks, **extra):
+    if artworks is None:
+        fragment_cache.clear()
+        return
+    for artwork in artworks:
+        fragment_cache.invalidate(artwork['id'])
@@ -0,0 +1,104 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Password hashing and verification run on a small process pool: scrypt and
+# pbkdf2 burn tens of milliseconds of CPU, and doing that on the request
+# thread holds the GIL and starves every other thread in the worker. The
+# calling request still waits for its own answer, but the number of hashes in
+# flight is capped (callers beyond the cap wait up to PASSWORD_HASH_QUEUE_TIMEOUT
+# and then get HashingUnavailable) so a login storm queues instead of piling up.
+
+# Full werkzeug method spec, as it appears at the front of stored hashes.
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+
+class HashingUnavailable(Exception):
+    pass
+
+def hash_method(pwhash):
+    return pwhash.split('$', 1)[0] if pwhash else None
+
+@lru_cache(maxsize=None)
+def full_method(method):
+    # Stored hashes carry the full spec ('scrypt' is saved as
+    # 'scrypt:32768:8:1'), so needs_rehash compares against that.
+    return hash_method(generate_password_hash('', method))
+
+class PasswordHasher:
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+        self.configure()
+
+    def configure(self, method=DEFAULT_METHOD, workers=2, max_pending=None, timeout=5.0, queue_timeout=2.0):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            self.method = full_method(method)
+            self.workers = workers
+            self.timeout = timeout
+            self.queue_timeout = queue_timeout
+            self._slots = threading.BoundedSemaphore(max_pending or max(workers, 1) * 4)
+
+    def init_app(self, app):
+        self.configure(method=app.config.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD),
+                       workers=app.config.get('PASSWORD_HASH_WORKERS', 2),
+                       max_pending=app.config.get('PASSWORD_HASH_MAX_PENDING'),
+                       timeout=app.config.get('PASSWORD_HASH_TIMEOUT', 5.0),
+                       queue_timeout=app.config.get('PASSWORD_HASH_QUEUE_TIMEOUT', 2.0))
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn, not fork: the web worker is multi-threaded.
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _discard(self, executor):
+        # A worker died (OOM kill, segfault) and the pool is unusable; the
+        # next call starts a new one.
+        with self._lock:
+            if self._executor is executor:
+                executor.shutdown(wait=False)
+                self._executor = None
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise HashingUnavailable('too many password hashes in flight')
+        executor = self._pool()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._discard(executor)
+            raise HashingUnavailable('password hashing pool is broken')
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise HashingUnavailable(f'password hashing took longer than {self.timeout}s')
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise HashingUnavailable('password hashing pool is broken')
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        return hash_method(pwhash) != self.method
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,177 @@
+import gzip
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from functools import wraps
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+from project.cache import LRUCache
+from project.signals import artwork_changed, catalog_synced
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available.
+    brotli = None
+
+# Conditional GET and compression for catalog pages. A page's ETag is a hash
+# of everything it is rendered from: the catalog version (bumped in the same
+# transaction as every artwork write), the URL, the templates, and for a
+# signed-in user their id, profile version and cart count. A matching
+# If-None-Match is answered with 304 before the view runs; a miss on a hot
+# page is served from the compressed bodies kept in `pages`.
+
+COMPRESSIBLE_TYPES = {'text/html', 'text/css', 'text/plain', 'application/json', 'application/javascript'}
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+class CatalogVersion:
+    # Process-local copy of the catalog_version row, re-read at most once per
+    # `ttl` seconds. When another process has moved it on, the artworks it
+    # changed are fetched from catalog_changes and sent as catalog_synced, so
+    # the read models and caches update just those rows. If the log has been
+    # pruned past the version this process knows, they start over instead.
+    def __init__(self, ttl=1.0):
+        self.ttl = ttl
+        self._current = None
+        self._expires = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        if time.monotonic() < self._expires:
+            return self._current
+        # One thread syncs; the others keep serving the version they know.
+        if not self._lock.acquire(blocking=self._current is None):
+            return self._current
+        try:
+            if time.monotonic() < self._expires:
+                return self._current
+            from project.db import get_catalog_changes, get_catalog_version
+            current = get_catalog_version()
+            if self._current is None:
+                self._current = current
+            elif current[0] > self._current[0]:
+                catalog_synced.send(None, artworks=get_catalog_changes(self._current[0], current[0]))
+                self._current = current
+            self._expires = time.monotonic() + self.ttl
+            return self._current
+        finally:
+            self._lock.release()
+
+    def advance(self, version):
+        # A write in this process committed as `version` and has been applied
+        # here already. Unless another version landed in between (then the
+        # next get() replays it), there is nothing to catch up on.
+        with self._lock:
+            if self._current is not None and self._current[0] == version - 1:
+                self._current = (version, int(time.time()))
+
+catalog_version = CatalogVersion()
+
+# Compressed response bodies by (etag, encoding).
+pages = LRUCache(maxsize=256, ttl=300)
+
+COMPRESSORS = {'gzip': lambda data: gzip.compress(data, GZIP_LEVEL)}
+if brotli is not None:
+    COMPRESSORS['br'] = lambda data: brotli.compress(data, quality=BROTLI_QUALITY)
+
+def negotiate_encoding():
+    # Prefer brotli when the client accepts both equally.
+    return request.accept_encodings.best_match(['br', 'gzip'] if brotli else ['gzip'])
+
+def _validators():
+    from project.session import USER_VERSION_KEY, session_cart_count
+    version, updated_at = catalog_version.get()
+    parts = [current_app.config['TEMPLATE_VERSION'], str(version), request.full_path]
+    if current_user.is_authenticated:
+        parts += [str(current_user.id), str(session.get(USER_VERSION_KEY)), str(session_cart_count(current_user.id))]
+    etag = hashlib.blake2b('|'.join(parts).encode('utf-8'), digest_size=16).hexdigest()
+    return etag, datetime.fromtimestamp(updated_at, timezone.utc)
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        # Compressed responses carry "<etag>-<encoding>"; any of them is the
+        # same page.
+        for candidate in [etag] + [f'{etag}-{encoding}' for encoding in COMPRESSORS]:
+            if request.if_none_match.contains(candidate):
+                return candidate
+        return None
+    # Last-Modified only tracks the catalog, so it can't vouch for a page that
+    # also shows the user's cart.
+    if request.if_modified_since and not current_user.is_authenticated:
+        if last_modified <= request.if_modified_since:
+            return etag
+    return None
+
+def conditional(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        # Flashed messages are shown once, so those pages are never reused.
+        if request.method not in ('GET', 'HEAD') or '_flashes' in session:
+            return view(*args, **kwargs)
+        etag, last_modified = _validators()
+        matched = _not_modified(etag, last_modified)
+        if matched:
+            response = current_app.response_class(status=304)
+            response.set_etag(matched)
+        else:
+            encoding = negotiate_encoding()
+            body = pages.get((etag, encoding)) if encoding else None
+            if body is not None:
+                response = current_app.response_class(body, mimetype='text/html')
+                response.headers['Content-Encoding'] = encoding
+                response.set_etag(f'{etag}-{encoding}')
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                response.set_etag(etag)
+        response.last_modified = last_modified
+        response.cache_control.no_cache = True
+        response.cache_control.private = current_user.is_authenticated or None
+        response.vary.add('Accept-Encoding')
+        return response
+    return wrapper
+
+def compress_response(response):
+    if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < current_app.config.get('COMPRESS_MIN_SIZE', 500):
+        return response
+    etag, weak = response.get_etag()
+    compressed = COMPRESSORS[encoding](data)
+    if etag and not weak:
+        pages.set((etag, encoding), compressed)
+        response.set_etag(f'{etag}-{encoding}')
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+def _template_version(app):
+    # Changes whenever a template does, so a deploy never revalidates a page
+    # rendered by the old templates.
+    digest = hashlib.blake2b(digest_size=8)
+    for root, _, files in sorted(os.walk(os.path.join(app.root_path, app.template_folder))):
+        for name in sorted(files):
+            stat = os.stat(os.path.join(root, name))
+            digest.update(f'{name}:{stat.st_mtime_ns}:{stat.st_size}'.encode('utf-8'))
+    return digest.hexdigest()
+
+def init_app(app):
+    catalog_version.ttl = app.config.get('CATALOG_VERSION_TTL', 1.0)
+    pages.configure(app.config.get('PAGE_CACHE_SIZE', 256), app.config.get('PAGE_CACHE_TTL', 300))
+    app.config.setdefault('TEMPLATE_VERSION', _template_version(app))
+    if app.config.get('COMPRESS_ENABLED', True):
+        app.after_request(compress_response)
+
+@artwork_changed.connect
+def _on_artwork_changed(sender, version=None, **extra):
+    if version is not None:
+        catalog_version.advance(version)
@@ -0,0 +1,137 @@
+import hashlib
+import os
+import tempfile
+import threading
+import click
+from flask import Blueprint, abort, current_app, request, send_file, url_for
+from flask.cli import AppGroup
+from werkzeug.utils import safe_join
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; without it pages use the originals.
+    Image = None
+
+# Resized and WebP copies of the images under static/. Templates ask for a
+# srcset through image_srcset()/image_url(); each URL carries a digest of the
+# source file, so a derived image can be cached forever and a new upload gets
+# a new URL. Derivatives are written on first request (or ahead of time with
+# `flask images build`) into IMAGE_CACHE_DIR/<digest>/<width>.<format>.
+
+WIDTHS = (320, 640, 960, 1280)
+FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+QUALITY = {'webp': 80, 'jpeg': 82}
+ONE_YEAR = 365 * 24 * 3600
+
+images_bp = Blueprint('images', __name__)
+
+_digests = {}
+_digest_lock = threading.Lock()
+
+def _source_path(filename):
+    path = safe_join(current_app.static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        return None
+    return path
+
+def source_digest(path):
+    # Cached per (mtime, size) so a page full of tiles costs one stat each.
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _digests.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            sha.update(chunk)
+    digest = sha.hexdigest()[:16]
+    with _digest_lock:
+        _digests[path] = (key, digest)
+    return digest
+
+def _cache_dir():
+    return current_app.config.get('IMAGE_CACHE_DIR') or os.path.join(current_app.instance_path, 'derived')
+
+def derive(path, digest, width, fmt):
+    target = os.path.join(_cache_dir(), digest, f'{width}.{fmt}')
+    if os.path.exists(target):
+        return target
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with Image.open(path) as image:
+        image.thumbnail((width, width * 4))
+        if fmt == 'jpeg' and image.mode not in ('RGB', 'L'):
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image.convert('RGBA'), mask=image.convert('RGBA').getchannel('A'))
+            image = background
+        # Write to a temp file and rename, so concurrent requests never see
+        # a half-written image.
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                image.save(f, FORMATS[fmt], quality=QUALITY[fmt], optimize=True)
+            os.replace(tmp, target)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    return target
+
+def image_url(filename, width, fmt='jpeg'):
+    path = _source_path(filename) if Image is not None else None
+    if path is None:
+        return url_for('static', filename=filename)
+    return url_for('images.derived_image', width=width, fmt=fmt, filename=filename, v=source_digest(path))
+
+def image_srcset(filename, fmt='webp', widths=WIDTHS):
+    path = _source_path(filename) if Image is not None else None
+    if path is None:
+        return ''
+    digest = source_digest(path)
+    return ', '.join(
+        f"{url_for('images.derived_image', width=width, fmt=fmt, filename=filename, v=digest)} {width}w"
+        for width in widths)
+
+@images_bp.route('/media/<int:width>/<fmt>/<path:filename>')
+def derived_image(width, fmt, filename):
+    if Image is None or width not in WIDTHS or fmt not in FORMATS:
+        abort(404)
+    path = _source_path(filename)
+    if path is None:
+        abort(404)
+    digest = source_digest(path)
+    # A request for the current version can be cached forever; a stale or
+    # missing version still gets the current image, but not pinned.
+    current = request.args.get('v') == digest
+    response = send_file(derive(path, digest, width, fmt), mimetype=f'image/{fmt}',
+                         max_age=ONE_YEAR if current else 300)
+    response.cache_control.immutable = current
+    return response
+
+images_cli = AppGroup('images', help='Derived image cache.')
+
+@images_cli.command('build')
+def build_command():
+    """Generate every thumbnail and WebP variant ahead of time."""
+    if Image is None:
+        raise click.ClickException('Pillow is not installed.')
+    from project.db import get_image_urls
+    filenames = set(get_image_urls())
+    img_dir = os.path.join(current_app.static_folder, 'img')
+    filenames.update(f'img/{name}' for name in os.listdir(img_dir))
+    built = 0
+    for filename in sorted(filenames):
+        path = _source_path(filename)
+        if path is None:
+            continue
+        digest = source_digest(path)
+        for width in WIDTHS:
+            for fmt in FORMATS:
+                derive(path, digest, width, fmt)
+                built += 1
+    click.echo(f'{built} derived images in {_cache_dir()}')
+
+def init_app(app):
+    app.register_blueprint(images_bp)
+    app.cli.add_command(images_cli)
+    app.add_template_global(image_url)
+    app.add_template_global(image_srcset)
@@ -0,0 +1,305 @@
+import csv
+import json
+import os
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from project import mysql
+from project.db import bump_catalog_version
+from project.jobs import enqueue, handler, job_workers
+from project.metrics import instrument
+
+# Bulk artwork import from CSV or JSON Lines. The input is streamed record by
+# record; valid rows are written CHUNK_SIZE at a time as one multi-row INSERT,
+# and each chunk commits together with the job's checkpoint row in
+# artwork_imports. A failed or interrupted import resumes from its last
+# committed chunk without duplicating anything. Uploads through the web form
+# are saved under IMPORT_UPLOAD_DIR and imported by a background job, so a
+# large file doesn't run into the web server's request timeout; that
+# directory has to be shared with the job workers if they run elsewhere.
+#
+#   flask artworks import gallery.csv --artist-id 42
+#   flask artworks import gallery.csv --resume 7
+
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+FORMATS = ('csv', 'jsonl')
+STATUSES = ('available', 'sold')
+COLUMNS = ('title', 'artist_name', 'artist_id', 'description', 'medium', 'dimensions', 'price', 'image_url', 'status')
+TEXT_LIMITS = {'title': 200, 'artist_name': 100, 'medium': 100, 'dimensions': 50, 'image_url': 255}
+# TEXT columns are limited in bytes, not characters.
+BYTE_LIMITS = {'description': 65535}
+MAX_PRICE = Decimal('99999999.99')
+
+class ImportRowError(ValueError):
+    pass
+
+class ImportConflict(Exception):
+    # Another run of the same import committed the chunk first.
+    pass
+
+def guess_format(filename):
+    return 'jsonl' if os.path.splitext(filename or '')[1].lower() in ('.jsonl', '.ndjson', '.json') else 'csv'
+
+def iter_records(stream, fmt):
+    # Yields one dict per input record; a JSON line that doesn't parse is
+    # passed on as an ImportRowError so it is counted against its line.
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield ImportRowError('not valid JSON')
+            continue
+        yield record if isinstance(record, dict) else ImportRowError('not a JSON object')
+
+def _text(record, field, required=False):
+    value = record.get(field)
+    value = str(value).strip() if value is not None else ''
+    if required and not value:
+        raise ImportRowError(f'{field} is required')
+    if field in TEXT_LIMITS and len(value) > TEXT_LIMITS[field]:
+        raise ImportRowError(f'{field} is longer than {TEXT_LIMITS[field]} characters')
+    if field in BYTE_LIMITS and len(value.encode('utf-8')) > BYTE_LIMITS[field]:
+        raise ImportRowError(f'{field} is longer than {BYTE_LIMITS[field]} bytes')
+    return value or None
+
+def validate(record, artist=None, artist_ids=None):
+    # Returns the row to insert, in COLUMNS order. `artist` is (id, name) for
+    # an artist importing their own work; admins may name any artist_id in
+    # `artist_ids`.
+    if isinstance(record, ImportRowError):
+        raise record
+    title = _text(record, 'title', required=True)
+    try:
+        price = Decimal(str(record.get('price', '')).strip().lstrip('$').replace(',', ''))
+    except InvalidOperation:
+        raise ImportRowError('price is not a number')
+    if not price.is_finite() or price <= 0 or price > MAX_PRICE:
+        raise ImportRowError('price must be between 0.01 and 99999999.99')
+    image_url = _text(record, 'image_url')
+    if image_url and ('://' in image_url or image_url.startswith('/') or '..' in image_url.split('/')):
+        raise ImportRowError('image_url must be a path under static/, e.g. img/piece.png')
+    status = (_text(record, 'status') or 'available').lower()
+    if status not in STATUSES:
+        raise ImportRowError(f'status must be one of {", ".join(STATUSES)}')
+    if artist is not None:
+        artist_id, artist_name = artist
+    else:
+        artist_name = _text(record, 'artist_name')
+        artist_id = _text(record, 'artist_id')
+        if artist_id is not None:
+            try:
+                artist_id = int(artist_id)
+            except ValueError:
+                raise ImportRowError('artist_id is not an integer')
+            if artist_ids is not None and artist_id not in artist_ids:
+                raise ImportRowError(f'artist_id {artist_id} is not an artist')
+    return (title, artist_name, artist_id, _text(record, 'description'), _text(record, 'medium'),
+            _text(record, 'dimensions'), price.quantize(Decimal('0.01')), image_url, status)
+
+def get_artist_ids():
+    cur = mysql.connection.cursor()
+    cur.execute("SELECT id FROM users WHERE role = 'artist'")
+    artist_ids = {row['id'] for row in cur.fetchall()}
+    cur.close()
+    return artist_ids
+
+def start_import(user_id, source, fmt):
+    cur = mysql.connection.cursor()
+    try:
+        cur.execute("INSERT INTO artwork_imports (user_id, source, format) VALUES (%s, %s, %s)",
+                    (user_id, source, fmt))
+        job_id = cur.lastrowid
+        mysql.commit()
+    except Exception as e:
+        mysql.connection.rollback()
+        raise e
+    finally:
+        cur.close()
+    return job_id
+
+def get_import(job_id):
+    cur = mysql.connection.cursor()
+    cur.execute("SELECT * FROM artwork_imports WHERE id = %s", (job_id,))
+    job = cur.fetchone()
+    cur.close()
+    return job
+
+def _commit_chunk(job_id, checkpoint, rows, processed, rejected, errors, status='running'):
+    # Rows, checkpoint and catalog version in one transaction. The web
+    # workers pick the new artworks up from the catalog change log.
+    cur = mysql.connection.cursor()
+    try:
+        cur.execute("SELECT rows_processed FROM artwork_imports WHERE id = %s FOR UPDATE", (job_id,))
+        if cur.fetchone()['rows_processed'] != checkpoint:
+            raise ImportConflict(f'import {job_id} was continued by another run')
+        if rows:
+            placeholders = ', '.join(['(' + ', '.join(['%s'] * len(COLUMNS)) + ')'] * len(rows))
+            cur.execute(f"INSERT INTO artworks ({', '.join(COLUMNS)}) VALUES {placeholders}",
+                        [value for row in rows for value in row])
+            # One multi-row INSERT gets consecutive ids, starting at lastrowid.
+            bump_catalog_version(cur, range(cur.lastrowid, cur.lastrowid + len(rows)))
+        cur.execute("""
+            UPDATE artwork_imports
+            SET rows_processed = rows_processed + %s, rows_inserted = rows_inserted + %s,
+                rows_rejected = rows_rejected + %s, errors = %s, status = %s
+            WHERE id = %s
+        """, (processed, len(rows), rejected, json.dumps(errors), status, job_id))
+        mysql.commit()
+    except Exception as e:
+        mysql.connection.rollback()
+        raise e
+    finally:
+        cur.close()
+
+def import_artworks(stream, fmt, job_id, artist=None, chunk_size=CHUNK_SIZE, progress=None):
+    # Imports `stream` under an existing artwork_imports job, skipping the
+    # records an earlier run already committed. Returns a summary dict.
+    job = get_import(job_id)
+    skip = job['rows_processed']
+    records = islice(iter_records(stream, fmt), skip, None)
+    # Checked per row up front, so a bad artist_id rejects its row instead of
+    # failing the chunk's INSERT on the foreign key.
+    artist_ids = get_artist_ids() if artist is None else None
+    summary = {'job_id': job_id, 'inserted': job['rows_inserted'], 'rejected': job['rows_rejected'],
+               'processed': skip, 'errors': [tuple(error) for error in json.loads(job['errors'] or '[]')]}
+    started = time.perf_counter()
+    # Problems are reported once the chunk they belong to has committed.
+    rows, processed, rejected, errors = [], 0, 0, []
+    try:
+        for number, record in enumerate(records, start=skip + 1):
+            try:
+                rows.append(validate(record, artist, artist_ids))
+            except ImportRowError as e:
+                rejected += 1
+                if len(summary['errors']) + len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append((number, str(e)))
+            processed += 1
+            if processed == chunk_size:
+                _commit_chunk(job_id, summary['processed'], rows, processed, rejected, summary['errors'] + errors)
+                summary['inserted'] += len(rows)
+                summary['rejected'] += rejected
+                summary['processed'] += processed
+                summary['errors'] += errors
+                rows, processed, rejected, errors = [], 0, 0, []
+                if progress:
+                    progress(summary, time.perf_counter() - started)
+        _commit_chunk(job_id, summary['processed'], rows, processed, rejected, summary['errors'] + errors,
+                      status='completed')
+        summary['inserted'] += len(rows)
+        summary['rejected'] += rejected
+        summary['processed'] += processed
+        summary['errors'] += errors
+    except ImportConflict:
+        raise
+    except Exception as e:
+        if isinstance(e, (UnicodeDecodeError, csv.Error)):
+            reason = f'the file could not be read ({e})'
+        else:
+            reason = 'the database rejected the next chunk'
+        _mark_failed(job_id, summary['errors'] + [(summary['processed'] + 1, f'Stopped here: {reason}')])
+        raise
+    summary['seconds'] = time.perf_counter() - started
+    return summary
+
+def _mark_failed(job_id, errors):
+    cur = mysql.connection.cursor()
+    try:
+        mysql.connection.rollback()
+        cur.execute("UPDATE artwork_imports SET status = 'failed', errors = %s WHERE id = %s",
+                    (json.dumps(errors), job_id))
+        mysql.commit()
+    except Exception:
+        mysql.connection.rollback()
+    finally:
+        cur.close()
+
+def upload_dir():
+    return current_app.config.get('IMPORT_UPLOAD_DIR') or os.path.join(current_app.instance_path, 'imports')
+
+def queue_upload(file_storage, job_id, fmt, artist=None):
+    # Saves the upload and queues its import; the job deletes the file once
+    # the import completes.
+    os.makedirs(upload_dir(), exist_ok=True)
+    path = os.path.join(upload_dir(), f'{job_id}-{os.urandom(8).hex()}.{fmt}')
+    file_storage.save(path)
+    cur = mysql.connection.cursor()
+    try:
+        cur.execute("UPDATE artwork_imports SET status = 'queued' WHERE id = %s", (job_id,))
+        enqueue(cur, 'artworks.import', job_id=job_id, path=path, fmt=fmt, artist=artist)
+        mysql.commit()
+    except Exception as e:
+        mysql.connection.rollback()
+        os.remove(path)
+        raise e
+    finally:
+        cur.close()
+    job_workers.wake()
+
+@handler('artworks.import')
+def run_upload(cur, job_id, path, fmt, artist=None):
+    # Chunks commit on their own as they go. A database error is retried by
+    # the job queue and resumes from the last chunk, so the file is kept; a
+    # file that can't be read is not retried, and the import stays 'failed'
+    # with the reason in its errors until it is resumed with a fixed upload.
+    try:
+        with open(path, encoding='utf-8-sig', newline='') as stream:
+            import_artworks(stream, fmt, job_id, artist=tuple(artist) if artist else None)
+    except (UnicodeDecodeError, csv.Error, ImportConflict):
+        pass
+    os.remove(path)
+
+artworks_cli = AppGroup('artworks', help='Catalog maintenance.')
+
+@artworks_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='Defaults from the file extension.')
+@click.option('--artist-id', type=int, help='Import every row as this artist\'s work.')
+@click.option('--chunk-size', type=int, default=CHUNK_SIZE, show_default=True)
+@click.option('--resume', 'resume_id', type=int, help='Continue an interrupted import job.')
+def import_command(path, fmt, artist_id, chunk_size, resume_id):
+    """Stream artworks from a CSV or JSON Lines file into the catalog."""
+    from project.db import get_user_by_id
+    fmt = fmt or guess_format(path)
+    artist = None
+    if artist_id is not None:
+        user = get_user_by_id(artist_id)
+        if user is None or user.role != 'artist':
+            raise click.ClickException(f'User {artist_id} is not an artist.')
+        artist = (artist_id, f'{user.firstname} {user.lastname}')
+    source = os.path.abspath(path)
+    if resume_id is not None:
+        job = get_import(resume_id)
+        if job is None or job['source'] != source:
+            raise click.ClickException(f'Import {resume_id} was not started from {source}.')
+        if job['status'] == 'completed':
+            raise click.ClickException(f'Import {resume_id} already completed.')
+        job_id = resume_id
+        click.echo(f'Resuming import {job_id} after {job["rows_processed"]} records')
+    else:
+        job_id = start_import(artist_id, source, fmt)
+        click.echo(f'Import {job_id} started (resume with --resume {job_id})')
+
+    def report(summary, elapsed):
+        click.echo(f"  {summary['processed']:>10} records  {summary['inserted']:>10} inserted  "
+                   f"{summary['rejected']:>6} rejected  {summary['processed'] / elapsed if elapsed else 0:,.0f} rows/s")
+
+    with open(path, encoding='utf-8-sig', newline='') as stream:
+        summary = import_artworks(stream, fmt, job_id, artist=artist, chunk_size=chunk_size, progress=report)
+    for number, message in summary['errors']:
+        click.echo(f'  record {number}: {message}', err=True)
+    click.echo(f"Import {job_id} completed: {summary['inserted']} inserted, {summary['rejected']} rejected "
+               f"in {summary['seconds']:.1f}s")
+
+def init_app(app):
+    app.cli.add_command(artworks_cli)
+
+instrument(globals(), ['get_artist_ids', 'start_import', 'get_import', '_commit_chunk', '_mark_failed', 'queue_upload'])
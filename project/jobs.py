@@ -0,0 +1,274 @@
+import atexit
+import json
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+import click
+from flask.cli import AppGroup
+from project import mysql
+from project.metrics import instrument, instrumented
+
+# Durable background jobs. A job is a row in the jobs table, enqueued with the
+# caller's cursor so it commits (or rolls back) with the work that produced
+# it. Worker threads in each web process, or `flask jobs work`, claim ready
+# rows with SELECT ... FOR UPDATE SKIP LOCKED and run the registered handler
+# with a cursor of their own; the handler's writes and the job's completion
+# commit together, so database work in a handler happens exactly once while
+# side effects such as mail are at-least-once. Failures are retried with
+# exponential backoff up to max_attempts, then left 'failed' for
+# `flask jobs retry`.
+#
+# run_at is when a queued job becomes ready, and for a running one when its
+# lease runs out: a worker that dies mid-job leaves a row that is simply ready
+# again JOBS_LEASE seconds later.
+
+HANDLERS = {}
+
+def handler(name):
+    def decorator(f):
+        HANDLERS[name] = f
+        return f
+    return decorator
+
+def enqueue(cur, name, delay=0, max_attempts=None, **payload):
+    # Use the cursor of the transaction the job belongs to; call
+    # job_workers.wake() after it commits.
+    cur.execute("""
+        INSERT INTO jobs (name, payload, max_attempts, run_at)
+        VALUES (%s, %s, %s, %s)
+    """, (name, json.dumps(payload, default=str), max_attempts or job_workers.max_attempts,
+          datetime.now() + timedelta(seconds=delay)))
+    return cur.lastrowid
+
+class JobWorkers:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._pid = None
+        self.app = None
+        self.configure()
+
+    def configure(self, workers=2, batch_size=10, poll_interval=1.0, lease=300, max_attempts=5,
+                  backoff=5.0, max_backoff=3600.0):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def init_app(self, app):
+        self.configure(workers=app.config.get('JOBS_WORKERS', 2),
+                       batch_size=app.config.get('JOBS_BATCH_SIZE', 10),
+                       poll_interval=app.config.get('JOBS_POLL_INTERVAL', 1.0),
+                       lease=app.config.get('JOBS_LEASE', 300),
+                       max_attempts=app.config.get('JOBS_MAX_ATTEMPTS', 5),
+                       backoff=app.config.get('JOBS_BACKOFF', 5.0),
+                       max_backoff=app.config.get('JOBS_MAX_BACKOFF', 3600.0))
+        self.app = app
+        if self.workers:
+            app.before_request(self.start)
+        app.cli.add_command(jobs_cli)
+
+    def start(self):
+        # Threads don't survive fork, so every (pre-forked) web worker starts
+        # its own pool on its first request.
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._threads = [threading.Thread(target=self._run, args=(f'{socket.gethostname()}:{self._pid}:{i}',),
+                                              name=f'job-worker-{i}', daemon=True)
+                             for i in range(self.workers)]
+            for thread in self._threads:
+                thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self, worker_id):
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    ran = self.run_pending(worker_id)
+            except Exception:
+                self.app.logger.exception('Job worker %s could not poll for jobs', worker_id)
+                ran = 0
+            if not ran:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def run_pending(self, worker_id=None, limit=None):
+        # Claims up to `limit` ready jobs and runs them; returns how many.
+        worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+        jobs = self._claim(worker_id, limit or self.batch_size)
+        for job in jobs:
+            self._execute(job, worker_id)
+        return len(jobs)
+
+    def _claim(self, worker_id, limit):
+        now = datetime.now()
+        cur = mysql.connection.cursor()
+        try:
+            cur.execute("""
+                SELECT id, name, payload, attempts, max_attempts
+                FROM jobs
+                WHERE status IN ('queued', 'running') AND run_at <= %s
+                ORDER BY run_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (now, limit))
+            jobs = cur.fetchall()
+            if jobs:
+                cur.execute(f"""
+                    UPDATE jobs
+                    SET status = 'running', attempts = attempts + 1, locked_by = %s, run_at = %s
+                    WHERE id IN ({', '.join(['%s'] * len(jobs))})
+                """, (worker_id, now + timedelta(seconds=self.lease), *(job['id'] for job in jobs)))
+            mysql.commit()
+        except Exception as e:
+            mysql.connection.rollback()
+            raise e
+        finally:
+            cur.close()
+        return jobs
+
+    def _execute(self, job, worker_id):
+        cur = mysql.connection.cursor()
+        try:
+            # Still ours? Not if our lease ran out and another worker took it.
+            cur.execute("SELECT id FROM jobs WHERE id = %s AND status = 'running' AND locked_by = %s FOR UPDATE",
+                        (job['id'], worker_id))
+            if cur.fetchone() is None:
+                mysql.connection.rollback()
+                return
+            if job['attempts'] >= job['max_attempts']:
+                raise RuntimeError('worker lease expired on every attempt')
+            if job['name'] not in HANDLERS:
+                raise LookupError(f"no handler registered for {job['name']!r}")
+            HANDLERS[job['name']](cur, **json.loads(job['payload']))
+            cur.execute("UPDATE jobs SET status = 'done', locked_by = NULL, last_error = NULL WHERE id = %s",
+                        (job['id'],))
+            mysql.commit()
+        except Exception:
+            mysql.connection.rollback()
+            self._retry_or_fail(job, worker_id, traceback.format_exc())
+        finally:
+            cur.close()
+
+    def _retry_or_fail(self, job, worker_id, error):
+        attempts = job['attempts'] + 1
+        if attempts >= job['max_attempts']:
+            status, run_at = 'failed', datetime.now()
+            self.app.logger.error('Job %s (%s) failed after %d attempts:\n%s', job['id'], job['name'], attempts, error)
+        else:
+            # Exponential backoff with jitter, so a burst of failures (mail
+            # server down) doesn't come back as a burst of retries.
+            delay = min(self.backoff * 2 ** (attempts - 1), self.max_backoff) * random.uniform(0.8, 1.2)
+            status, run_at = 'queued', datetime.now() + timedelta(seconds=delay)
+            self.app.logger.warning('Job %s (%s) attempt %d failed; retrying in %.0fs', job['id'], job['name'],
+                                    attempts, delay)
+        cur = mysql.connection.cursor()
+        try:
+            cur.execute("""
+                UPDATE jobs
+                SET status = %s, run_at = %s, locked_by = NULL, last_error = %s
+                WHERE id = %s AND locked_by = %s
+            """, (status, run_at, error[-4000:], job['id'], worker_id))
+            mysql.commit()
+        except Exception:
+            # The lease runs out and the job is retried anyway.
+            mysql.connection.rollback()
+            self.app.logger.exception('Could not record failure of job %s', job['id'])
+        finally:
+            cur.close()
+
+# Not _execute: a job's run is mostly its handler's work.
+instrument(globals(), ['enqueue'])
+JobWorkers._claim = instrumented(JobWorkers._claim)
+JobWorkers._retry_or_fail = instrumented(JobWorkers._retry_or_fail)
+
+job_workers = JobWorkers()
+
+jobs_cli = AppGroup('jobs', help='Background job queue.')
+
+@jobs_cli.command('work')
+@click.option('--once', is_flag=True, help='Run the jobs that are ready now, then exit.')
+def work_command(once):
+    """Run jobs in this process (for deployments with JOBS_WORKERS = 0)."""
+    total = 0
+    while True:
+        ran = job_workers.run_pending()
+        total += ran
+        if not ran:
+            if once:
+                break
+            time.sleep(job_workers.poll_interval)
+    click.echo(f'Ran {total} jobs')
+
+@jobs_cli.command('status')
+def status_command():
+    """Show job counts by name and status."""
+    cur = mysql.connection.cursor()
+    cur.execute("SELECT name, status, COUNT(*) AS jobs FROM jobs GROUP BY name, status ORDER BY name, status")
+    for row in cur.fetchall():
+        click.echo(f"{row['name']:<32} {row['status']:<8} {row['jobs']:>8}")
+    cur.close()
+
+@jobs_cli.command('retry')
+@click.argument('job_ids', nargs=-1, type=int)
+def retry_command(job_ids):
+    """Queue failed jobs again (all of them, or the given ids)."""
+    where = "status = 'failed'"
+    if job_ids:
+        where += f" AND id IN ({', '.join(['%s'] * len(job_ids))})"
+    cur = mysql.connection.cursor()
+    try:
+        cur.execute(f"UPDATE jobs SET status = 'queued', attempts = 0, run_at = %s WHERE {where}",
+                    (datetime.now(), *job_ids))
+        count = cur.rowcount
+        mysql.commit()
+    except Exception as e:
+        mysql.connection.rollback()
+        raise e
+    finally:
+        cur.close()
+    click.echo(f'Queued {count} jobs again')
+
+@jobs_cli.command('purge')
+@click.option('--days', type=int, default=7, show_default=True)
+def purge_command(days):
+    """Delete finished jobs and catalog change-log entries older than --days."""
+    cur = mysql.connection.cursor()
+    try:
+        cur.execute("DELETE FROM jobs WHERE status = 'done' AND updated_at < %s",
+                    (datetime.now() - timedelta(days=days),))
+        count = cur.rowcount
+        mysql.commit()
+    except Exception as e:
+        mysql.connection.rollback()
+        raise e
+    finally:
+        cur.close()
+    click.echo(f'Deleted {count} finished jobs')
+    # Web workers sync from the change log every CATALOG_VERSION_TTL; one
+    # idle for longer than --days just reloads.
+    from project.db import prune_catalog_changes
+    click.echo(f'Deleted {prune_catalog_changes(datetime.now() - timedelta(days=days))} catalog change-log entries')
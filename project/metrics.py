@@ -0,0 +1,242 @@
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from functools import wraps
+from flask import Blueprint, Response, current_app, g, has_app_context, request
+
+# Request, db-call and query instrumentation, exported in Prometheus text
+# format. Everything is off unless METRICS_ENABLED is set: the request hooks
+# and the /metrics route are then never registered, queries are not counted,
+# and an instrumented db function costs one flag check.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+class _State:
+    enabled = False
+    n_plus_one_threshold = 10
+
+state = _State()
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}   # (name, labels) -> Histogram
+        self.counters = Counter()
+
+    def histogram(self, name, labels, buckets=LATENCY_BUCKETS):
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(key, Histogram(buckets))
+        return histogram
+
+    def inc(self, name, labels, amount=1):
+        with self._lock:
+            self.counters[(name, labels)] += amount
+
+    def clear(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+registry = Registry()
+
+def _row_count(result):
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    if result is None or result is False:
+        return 0
+    items = getattr(result, 'items', None)
+    if isinstance(items, list):
+        return len(items)
+    return 1
+
+def _queries():
+    return g.get('_metrics_queries', 0) if has_app_context() else None
+
+def _observe(name, seconds, rows, queries):
+    labels = (('function', name),)
+    if queries is not None and queries == _queries():
+        # Answered from a cache without touching the database.
+        registry.inc('artspace_db_cache_hits_total', labels)
+        return
+    registry.histogram('artspace_db_call_seconds', labels).observe(seconds)
+    registry.inc('artspace_db_call_rows_total', labels, rows)
+    if has_app_context():
+        g.setdefault('_metrics_calls', Counter())[name] += 1
+
+def instrumented(fn):
+    name = fn.__qualname__
+
+    if inspect.isgeneratorfunction(fn):
+        # Timed over the whole iteration, excluding the caller's time between
+        # rows; each yielded item counts as a row.
+        @wraps(fn)
+        def generator_wrapper(*args, **kwargs):
+            if not state.enabled:
+                return (yield from fn(*args, **kwargs))
+            queries, seconds, rows = _queries(), 0.0, 0
+            iterator = fn(*args, **kwargs)
+            try:
+                while True:
+                    started = time.perf_counter()
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        break
+                    except Exception:
+                        registry.inc('artspace_db_call_errors_total', (('function', name),))
+                        raise
+                    finally:
+                        seconds += time.perf_counter() - started
+                    rows += 1
+                    yield item
+            finally:
+                iterator.close()
+            _observe(name, seconds, rows, queries)
+        return generator_wrapper
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not state.enabled:
+            return fn(*args, **kwargs)
+        queries, started = _queries(), time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            registry.inc('artspace_db_call_errors_total', (('function', name),))
+            raise
+        _observe(name, time.perf_counter() - started, _row_count(result), queries)
+        return result
+    return wrapper
+
+def instrument(namespace, names=None):
+    # Wraps db functions in place, at the bottom of their module (db, sales,
+    # importer, jobs): the given names, or every public function the module
+    # defines. They are then timed whenever metrics are enabled.
+    if names is None:
+        names = [name for name, function in namespace.items()
+                 if inspect.isfunction(function) and function.__module__ == namespace['__name__']
+                 and not name.startswith('_')]
+    for name in names:
+        namespace[name] = instrumented(namespace[name])
+
+def counting_cursor(base):
+    # Subclass of the configured cursor class that counts statements per request.
+    class InstrumentedCursor(base):
+        def execute(self, query, args=None):
+            if has_app_context():
+                g._metrics_queries = g.get('_metrics_queries', 0) + 1
+            return super().execute(query, args)
+    InstrumentedCursor.__name__ = 'Instrumented' + base.__name__
+    return InstrumentedCursor
+
+def _before_request():
+    g._metrics_started = time.perf_counter()
+
+def _after_request(response):
+    started = g.pop('_metrics_started', None)
+    if started is None:
+        return response
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    labels = (('method', request.method), ('route', route))
+    registry.histogram('artspace_request_seconds', labels).observe(time.perf_counter() - started)
+    registry.inc('artspace_requests_total', labels + (('status', str(response.status_code)),))
+    registry.histogram('artspace_request_queries', (('route', route),), COUNT_BUCKETS).observe(
+        g.pop('_metrics_queries', 0))
+    for function, calls in g.pop('_metrics_calls', Counter()).items():
+        if calls > state.n_plus_one_threshold:
+            registry.inc('artspace_n_plus_one_total', (('function', function), ('route', route)))
+            current_app.logger.warning('Possible N+1: %s called %d times while serving %s',
+                                       function, calls, route)
+    return response
+
+def _format_labels(labels, extra=()):
+    pairs = tuple(labels) + tuple(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+def render():
+    from project import mysql
+    from project.cache import cart_count_cache, catalog_cache, platform_counts_cache, user_cache
+    from project.fragments import fragment_cache
+
+    lines = []
+    by_name = {}
+    for (name, labels), histogram in sorted(registry.histograms.items()):
+        by_name.setdefault(name, []).append((labels, histogram))
+    for name, series in by_name.items():
+        lines.append(f'# TYPE {name} histogram')
+        for labels, histogram in series:
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels, (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {histogram.sum}')
+            lines.append(f'{name}_count{_format_labels(labels)} {histogram.count}')
+
+    counters = {}
+    for (name, labels), value in sorted(registry.counters.items()):
+        counters.setdefault(name, []).append((labels, value))
+    for name, series in counters.items():
+        lines.append(f'# TYPE {name} counter')
+        lines.extend(f'{name}{_format_labels(labels)} {value}' for labels, value in series)
+
+    lines.append('# TYPE artspace_db_pool gauge')
+    for key, value in mysql.stats().items():
+        lines.append(f'artspace_db_pool{{pool="primary",stat="{key}"}} {value}')
+    for replica, stats in mysql.replica_stats().items():
+        for key, value in stats.items():
+            lines.append(f'artspace_db_pool{{pool="{replica}",stat="{key}"}} {value}')
+    lines.append('# TYPE artspace_cache gauge')
+    caches = dict(catalog_cache.stats(), users=user_cache.stats(), cart_counts=cart_count_cache.stats(),
+                  platform_counts=platform_counts_cache.stats())
+    caches.update((f'fragments/{name}', stats) for name, stats in fragment_cache.stats().items())
+    for cache, stats in caches.items():
+        for key, value in stats.items():
+            lines.append(f'artspace_cache{{cache="{cache}",stat="{key}"}} {value}')
+    timings = current_app.extensions.get('startup_timings')
+    if timings:
+        lines.append('# TYPE artspace_startup_seconds gauge')
+        lines.extend(f'artspace_startup_seconds{{phase="{phase}"}} {seconds}' for phase, seconds in timings.items())
+    return '\n'.join(lines) + '\n'
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics')
+def metrics():
+    return Response(render(), mimetype='text/plain; version=0.0.4')
+
+def init_app(app):
+    state.enabled = app.config.get('METRICS_ENABLED', False)
+    state.n_plus_one_threshold = app.config.get('METRICS_N_PLUS_ONE_THRESHOLD', 10)
+    if not state.enabled:
+        return
+    from MySQLdb import cursors
+    base = app.config.get('MYSQL_CURSORCLASS') or cursors.Cursor
+    if isinstance(base, str):
+        base = getattr(cursors, base)
+    app.config['MYSQL_CURSORCLASS'] = counting_cursor(base)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.register_blueprint(metrics_bp)
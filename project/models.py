@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from werkzeug.security import generate_password_hash, check_password_hash
+from project.hashing import password_hasher
 
 @dataclass
 class User:
@@ -27,6 +27,51 @@ class User:
     def get_id(self):
         return self.id
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
\ No newline at end of file
+        return password_hasher.verify(self.password_hash, password)
+
+
+# What flask-login keeps as current_user on every request. Only the fields the
+# navbar, checkout and role checks need: no password hash and no bio.
+@dataclass(slots=True)
+class SessionUser:
+    id: int
+    role: str
+    username: str
+    firstname: str
+    lastname: str
+    email: str
+    phone: str = None
+    address: str = None
+    city: str = None
+    state: str = None
+    zip: str = None
+    country: str = None
+
+    def is_active(self):
+        return True
+    def is_authenticated(self):
+        return True
+    def is_anonymous(self):
+        return False
+    def get_id(self):
+        return self.id
+
+
+@dataclass
+class ArtworkPage:
+    items: list
+    sort: str
+    limit: int
+    next_cursor: str = None
+    prev_cursor: str = None
+    query: str = None
+    total: int = None
+
+@dataclass
+class OrderPage:
+    orders: list
+    limit: int
+    first: bool = True
+    next_cursor: str = None
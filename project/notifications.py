@@ -0,0 +1,34 @@
+from flask import render_template
+from flask_mail import Mail, Message
+from project.jobs import handler
+
+# Customer mail, sent from background jobs (see project/jobs.py) rather than
+# on the request path.
+
+mail = Mail()
+
+@handler('orders.send_confirmation')
+def send_order_confirmation(cur, order_id):
+    cur.execute("""
+        SELECT o.id, o.total_amount, o.shipping_cost, o.tax, o.shipping_address, o.payment_method,
+               o.created_at, u.email, u.firstname
+        FROM orders o
+        JOIN users u ON u.id = o.user_id
+        WHERE o.id = %s
+    """, (order_id,))
+    order = cur.fetchone()
+    if order is None or not order['email']:
+        return
+    cur.execute("""
+        SELECT a.title, a.artist_name, oi.price, oi.quantity
+        FROM order_items oi
+        JOIN artworks a ON a.id = oi.artwork_id
+        WHERE oi.order_id = %s
+        ORDER BY oi.id
+    """, (order_id,))
+    items = cur.fetchall()
+    mail.send(Message(f'Your ArtSpace order #{order_id}', recipients=[order['email']],
+                      body=render_template('email/order_confirmation.txt', order=order, items=items)))
+
+def init_app(app):
+    mail.init_app(app)
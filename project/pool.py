@@ -0,0 +1,311 @@
+import itertools
+import os
+import queue
+import threading
+import time
+from collections import ChainMap
+import MySQLdb
+from MySQLdb import cursors
+from flask import current_app, g, has_request_context, session
+
+# Drop-in replacement for flask_mysqldb.MySQL. Reads the same MYSQL_* config
+# keys and still hands out `mysql.connection`, but the connection comes from a
+# per-process pool and goes back to it at the end of the app context instead
+# of being opened and closed for every request.
+#
+# Reads can be spread over replicas (MYSQL_REPLICAS): db functions that only
+# read use `mysql.read_connection`, everything else uses `mysql.connection`,
+# which is always the primary. Replicas lagging more than
+# MYSQL_REPLICA_MAX_LAG seconds are skipped, and a session that has just
+# written reads from the primary for MYSQL_READ_YOUR_WRITES_WINDOW seconds so
+# its own cart and orders never look stale.
+
+READ_YOUR_WRITES_KEY = '_rw_until'
+
+class PoolTimeout(Exception):
+    pass
+
+class ConnectionPool:
+    def __init__(self, connect, size=10, timeout=5.0, ping_interval=30, recycle=3600):
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self.recycle = recycle
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._pid = os.getpid()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.failed_health_checks = 0
+        self.wait_seconds = 0.0
+
+    def _reset_after_fork(self):
+        # Connections must never be shared with a parent process.
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._pid = os.getpid()
+
+    def _new_connection(self):
+        conn = self._connect()
+        conn._pool_created_at = time.monotonic()
+        return conn
+
+    def acquire(self):
+        if os.getpid() != self._pid:
+            self._reset_after_fork()
+        started = time.monotonic()
+        try:
+            entry = self._idle.get_nowait()
+        except queue.Empty:
+            entry = None
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if not can_create:
+                try:
+                    entry = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    self.timeouts += 1
+                    raise PoolTimeout(f"no MySQL connection free after {self.timeout}s")
+        try:
+            conn = self._new_connection() if entry is None else self._check(*entry)
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+        self.checkouts += 1
+        self.wait_seconds += time.monotonic() - started
+        return conn
+
+    def _check(self, conn, last_used):
+        # Health check for connections that sat idle: too old ones are
+        # replaced, and ones idle past the ping interval must answer a ping.
+        now = time.monotonic()
+        if self.recycle and now - conn._pool_created_at > self.recycle:
+            self._close(conn)
+            return self._new_connection()
+        if now - last_used > self.ping_interval:
+            try:
+                conn.ping()
+            except MySQLdb.Error:
+                self.failed_health_checks += 1
+                self._close(conn)
+                return self._new_connection()
+        return conn
+
+    def release(self, conn, discard=False):
+        if os.getpid() != self._pid:
+            return
+        if not discard:
+            try:
+                # Ends the read snapshot (or any unfinished write) so the next
+                # borrower starts clean.
+                conn.rollback()
+            except MySQLdb.Error:
+                discard = True
+        if discard:
+            self._close(conn)
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put((conn, time.monotonic()))
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except MySQLdb.Error:
+            pass
+
+    def stats(self):
+        idle = self._idle.qsize()
+        return {
+            'size': self.size,
+            'open': self._created,
+            'idle': idle,
+            'in_use': self._created - idle,
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'failed_health_checks': self.failed_health_checks,
+            'wait_seconds': self.wait_seconds,
+        }
+
+class Replica:
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        self.lag = None
+        self.checked_at = float('-inf')
+        self.down_until = float('-inf')
+
+    def acquire(self, max_lag, check_interval):
+        # Returns a connection, or None if the replica is down or too far behind.
+        now = time.monotonic()
+        if now < self.down_until:
+            return None
+        try:
+            conn = self.pool.acquire()
+        except (MySQLdb.Error, PoolTimeout):
+            self.down_until = now + check_interval
+            return None
+        if max_lag is None:
+            return conn
+        if now - self.checked_at > check_interval:
+            self.lag = self._measure_lag(conn)
+            self.checked_at = now
+        if self.lag is None or self.lag > max_lag:
+            self.pool.release(conn)
+            return None
+        return conn
+
+    def _measure_lag(self, conn):
+        cur = conn.cursor(cursors.DictCursor)
+        try:
+            try:
+                cur.execute("SHOW REPLICA STATUS")
+            except MySQLdb.Error:
+                cur.execute("SHOW SLAVE STATUS")  # MySQL < 8.0.22
+            row = cur.fetchone()
+        except MySQLdb.Error:
+            return None
+        finally:
+            cur.close()
+        # No row means the server is not replicating; NULL means the SQL
+        # thread is stopped. Either way its data can't be trusted.
+        if not row:
+            return None
+        for key in ('Seconds_Behind_Source', 'Seconds_Behind_Master'):
+            if key in row:
+                return row[key]
+        return None
+
+    def stats(self):
+        return dict(self.pool.stats(), lag=self.lag if self.lag is not None else -1)
+
+class MySQLPool:
+    def __init__(self, app=None):
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("MYSQL_HOST", "localhost")
+        app.config.setdefault("MYSQL_USER", None)
+        app.config.setdefault("MYSQL_PASSWORD", None)
+        app.config.setdefault("MYSQL_DB", None)
+        app.config.setdefault("MYSQL_PORT", 3306)
+        app.config.setdefault("MYSQL_UNIX_SOCKET", None)
+        app.config.setdefault("MYSQL_CONNECT_TIMEOUT", 10)
+        app.config.setdefault("MYSQL_READ_DEFAULT_FILE", None)
+        app.config.setdefault("MYSQL_USE_UNICODE", True)
+        app.config.setdefault("MYSQL_CHARSET", "utf8")
+        app.config.setdefault("MYSQL_SQL_MODE", None)
+        app.config.setdefault("MYSQL_CURSORCLASS", None)
+        app.config.setdefault("MYSQL_AUTOCOMMIT", False)
+        app.config.setdefault("MYSQL_CUSTOM_OPTIONS", None)
+        app.config.setdefault("MYSQL_POOL_SIZE", 10)
+        app.config.setdefault("MYSQL_POOL_TIMEOUT", 5.0)
+        app.config.setdefault("MYSQL_POOL_PING_INTERVAL", 30)
+        app.config.setdefault("MYSQL_POOL_RECYCLE", 3600)
+
+        app.config.setdefault("MYSQL_REPLICAS", [])
+        app.config.setdefault("MYSQL_REPLICA_MAX_LAG", 5)
+        app.config.setdefault("MYSQL_REPLICA_CHECK_INTERVAL", 5)
+        app.config.setdefault("MYSQL_READ_YOUR_WRITES_WINDOW", 5)
+
+        config = app.config
+        app.extensions['mysql_pool'] = self._make_pool(config)
+        # Each replica entry holds the MYSQL_* keys that differ from the
+        # primary, e.g. {"MYSQL_HOST": "replica-1"} or {"MYSQL_PORT": 3307}.
+        replicas = []
+        for overrides in config["MYSQL_REPLICAS"]:
+            replica_config = ChainMap(overrides, config)
+            name = f'{replica_config["MYSQL_HOST"]}:{replica_config["MYSQL_PORT"]}'
+            replicas.append(Replica(name, self._make_pool(replica_config)))
+        app.extensions['mysql_replicas'] = replicas
+        app.extensions['mysql_replica_rotation'] = itertools.count()
+        app.teardown_appcontext(self.teardown)
+
+    def _make_pool(self, config):
+        return ConnectionPool(
+            lambda: self.connect(config),
+            size=config["MYSQL_POOL_SIZE"],
+            timeout=config["MYSQL_POOL_TIMEOUT"],
+            ping_interval=config["MYSQL_POOL_PING_INTERVAL"],
+            recycle=config["MYSQL_POOL_RECYCLE"])
+
+    def connect(self, config):
+        kwargs = {}
+        for key, arg in (("MYSQL_HOST", "host"), ("MYSQL_USER", "user"), ("MYSQL_PASSWORD", "passwd"),
+                         ("MYSQL_DB", "db"), ("MYSQL_PORT", "port"), ("MYSQL_UNIX_SOCKET", "unix_socket"),
+                         ("MYSQL_CONNECT_TIMEOUT", "connect_timeout"),
+                         ("MYSQL_READ_DEFAULT_FILE", "read_default_file"), ("MYSQL_USE_UNICODE", "use_unicode"),
+                         ("MYSQL_CHARSET", "charset"), ("MYSQL_SQL_MODE", "sql_mode"),
+                         ("MYSQL_AUTOCOMMIT", "autocommit")):
+            if config[key]:
+                kwargs[arg] = config[key]
+        cursorclass = config["MYSQL_CURSORCLASS"]
+        if cursorclass:
+            kwargs["cursorclass"] = getattr(cursors, cursorclass) if isinstance(cursorclass, str) else cursorclass
+        if config["MYSQL_CUSTOM_OPTIONS"]:
+            kwargs.update(config["MYSQL_CUSTOM_OPTIONS"])
+        return MySQLdb.connect(**kwargs)
+
+    @property
+    def pool(self):
+        return current_app.extensions['mysql_pool']
+
+    @property
+    def connection(self):
+        if 'mysql_db' not in g:
+            g.mysql_db = self.pool.acquire()
+        return g.mysql_db
+
+    @property
+    def read_connection(self):
+        # Once this request has written, its reads go to the primary, even
+        # if it had already pinned a replica.
+        if 'mysql_wrote' in g:
+            return self.connection
+        if 'mysql_read_db' in g:
+            return g.mysql_read_db[1]
+        replicas = current_app.extensions['mysql_replicas']
+        if not replicas or self._recent_write():
+            return self.connection
+        config = current_app.config
+        start = next(current_app.extensions['mysql_replica_rotation'])
+        for i in range(len(replicas)):
+            replica = replicas[(start + i) % len(replicas)]
+            conn = replica.acquire(config["MYSQL_REPLICA_MAX_LAG"], config["MYSQL_REPLICA_CHECK_INTERVAL"])
+            if conn is not None:
+                g.mysql_read_db = (replica, conn)
+                return conn
+        # Every replica is down or lagging: the primary serves the reads.
+        return self.connection
+
+    def _recent_write(self):
+        return has_request_context() and session.get(READ_YOUR_WRITES_KEY, 0) > time.time()
+
+    def commit(self):
+        self.connection.commit()
+        g.mysql_wrote = True
+        if current_app.extensions['mysql_replicas'] and has_request_context():
+            session[READ_YOUR_WRITES_KEY] = time.time() + current_app.config["MYSQL_READ_YOUR_WRITES_WINDOW"]
+
+    def teardown(self, exception):
+        discard = isinstance(exception, MySQLdb.OperationalError)
+        conn = g.pop('mysql_db', None)
+        if conn is not None:
+            self.pool.release(conn, discard=discard)
+        replica_conn = g.pop('mysql_read_db', None)
+        if replica_conn is not None:
+            replica, conn = replica_conn
+            replica.pool.release(conn, discard=discard)
+
+    def stats(self):
+        return self.pool.stats()
+
+    def replica_stats(self):
+        return {replica.name: replica.stats() for replica in current_app.extensions['mysql_replicas']}
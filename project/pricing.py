@@ -0,0 +1,50 @@
+from dataclasses import dataclass, replace
+from decimal import Decimal, ROUND_HALF_UP
+from flask import current_app
+from project.db import get_cart_items
+
+# One place that turns a cart into money. The basket, checkout and payment
+# views all price through quote_cart(), which reads the cart once and does
+# the arithmetic in Decimal so every page shows the same totals.
+
+SHIPPING_FLAT_RATE = Decimal('45.00')
+TAX_RATE = Decimal('0.08')
+CENTS = Decimal('0.01')
+
+@dataclass(frozen=True)
+class Quote:
+    items: tuple
+    subtotal: Decimal
+    shipping: Decimal
+    tax: Decimal
+    total: Decimal
+    unavailable: tuple = ()     # cart items sold since they were added; not priced
+
+    # Only the amounts go into the session cookie; the items stay in the cart.
+    def to_session(self):
+        return {'subtotal': str(self.subtotal), 'shipping': str(self.shipping),
+                'tax': str(self.tax), 'total': str(self.total)}
+
+    @classmethod
+    def from_session(cls, data):
+        try:
+            return cls(items=(), subtotal=Decimal(data['subtotal']), shipping=Decimal(data['shipping']),
+                       tax=Decimal(data['tax']), total=Decimal(data['total']))
+        except (KeyError, TypeError, ArithmeticError):
+            return None
+
+def price_items(items, shipping_rate=SHIPPING_FLAT_RATE, tax_rate=TAX_RATE):
+    items = tuple(items)
+    subtotal = sum((Decimal(item['price']) * item['quantity'] for item in items), Decimal('0.00'))
+    subtotal = subtotal.quantize(CENTS, ROUND_HALF_UP)
+    shipping = Decimal(str(shipping_rate)).quantize(CENTS) if items else Decimal('0.00')
+    tax = (subtotal * Decimal(str(tax_rate))).quantize(CENTS, ROUND_HALF_UP)
+    return Quote(items=items, subtotal=subtotal, shipping=shipping, tax=tax,
+                 total=subtotal + shipping + tax)
+
+def quote_cart(user_id):
+    items = get_cart_items(user_id)
+    quote = price_items((item for item in items if item['status'] == 'available'),
+                        shipping_rate=current_app.config.get('SHIPPING_FLAT_RATE', SHIPPING_FLAT_RATE),
+                        tax_rate=current_app.config.get('TAX_RATE', TAX_RATE))
+    return replace(quote, unavailable=tuple(item for item in items if item['status'] != 'available'))
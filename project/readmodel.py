@@ -0,0 +1,134 @@
+import threading
+from abc import ABC, abstractmethod
+import numpy as np
+from project.signals import artwork_changed, catalog_synced
+
+# Base for the per-process read models of the available catalog (search index,
+# facet index, related artworks). A model loads itself from MySQL on first
+# use, under its lock so concurrent first requests share one table scan, and
+# is then kept current through the catalog signals: an artwork that becomes
+# available is added, anything else removes it.
+
+class ReadModel(ABC):
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.loaded = False
+        self._reset()
+        artwork_changed.connect(self._on_artwork_changed)
+        catalog_synced.connect(self._on_catalog_synced)
+
+    @abstractmethod
+    def _reset(self):
+        pass
+
+    @abstractmethod
+    def _source(self):
+        # Rows to load from; subclasses import the db layer lazily.
+        pass
+
+    @abstractmethod
+    def _add(self, row):
+        pass
+
+    @abstractmethod
+    def _remove(self, artwork_id):
+        pass
+
+    def _after_load(self):
+        pass
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+            self.loaded = False
+
+    def load(self, rows):
+        with self._lock:
+            self._reset()
+            for row in rows:
+                self._add(row)
+            self._after_load()
+            self.loaded = True
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            with self._lock:
+                if not self.loaded:
+                    self.load(self._source())
+        return self
+
+    def add(self, row):
+        with self._lock:
+            self._add(row)
+
+    def remove(self, artwork_id):
+        with self._lock:
+            self._remove(artwork_id)
+
+    def _on_artwork_changed(self, sender, artwork_id, status, artwork=None, **extra):
+        if not self.loaded:
+            return
+        if status == 'available' and artwork is not None:
+            self.add(artwork)
+        else:
+            self.remove(artwork_id)
+
+    def apply(self, artworks):
+        # A batch of changed rows, each with its current status.
+        with self._lock:
+            for artwork in artworks:
+                if artwork['status'] == 'available':
+                    self._add(artwork)
+                else:
+                    self._remove(artwork['id'])
+
+    def _on_catalog_synced(self, sender, artworks, **extra):
+        if artworks is None:
+            self.clear()
+        elif self.loaded:
+            self.apply(artworks)
+
+class ColumnarReadModel(ReadModel):
+    # Each artwork is one position in a set of parallel NumPy arrays, declared
+    # in COLUMNS as name -> (dtype, per-row shape, fill). Positions of removed
+    # artworks are not reused; loading again compacts them away.
+    COLUMNS = {}
+
+    def _reset(self, capacity=1024):
+        for name, (dtype, shape, fill) in self.COLUMNS.items():
+            setattr(self, name, np.full((capacity,) + shape, fill, dtype=dtype))
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._size = 0
+        self._rows = []
+        self._positions = {}    # artwork_id -> position
+
+    def __len__(self):
+        return len(self._positions)
+
+    def _place(self, row):
+        position = self._positions.get(row['id'])
+        if position is None:
+            if self._size == len(self._alive):
+                self._grow()
+            position = self._size
+            self._size += 1
+            self._positions[row['id']] = position
+            self._rows.append(None)
+        self._alive[position] = True
+        self._rows[position] = {key: value for key, value in row.items() if key != 'description'}
+        return position
+
+    def _drop(self, artwork_id):
+        position = self._positions.pop(artwork_id, None)
+        if position is not None:
+            self._alive[position] = False
+            self._rows[position] = None
+        return position
+
+    def _grow(self):
+        capacity = len(self._alive) * 2
+        for name, (dtype, shape, fill) in dict(self.COLUMNS, _alive=(bool, (), False)).items():
+            array = getattr(self, name)
+            grown = np.full((capacity,) + shape, fill, dtype=dtype)
+            grown[:len(array)] = array
+            setattr(self, name, grown)
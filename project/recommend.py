@@ -0,0 +1,229 @@
+import hashlib
+import logging
+import math
+import threading
+from functools import lru_cache
+import numpy as np
+from flask import current_app
+from project.readmodel import ColumnarReadModel
+from project.search import tokenize
+
+# "Related artworks" for the detail page. Every available artwork gets a
+# hashed feature vector (medium, artist, price band, title/description terms)
+# and the K most similar artworks are precomputed for all of them with batched
+# matrix products, so a detail page is one array lookup. A new artwork gets
+# its own neighbours and joins the lists it now belongs in; a sold one is
+# dropped and only the lists that contained it are recomputed. A large batch
+# (an import) is instead built into a fresh table on a background thread and
+# swapped in when ready; the old table keeps serving until then. Outside
+# production (where startup builds it) the first detail page starts the build
+# in the background and goes without related artworks until it is done.
+
+DIMENSIONS = 256
+NEIGHBOURS = 8
+BATCH_SIZE = 512
+REBUILD_THRESHOLD = 256
+
+logger = logging.getLogger(__name__)
+FEATURE_WEIGHTS = {'medium': 1.0, 'artist': 1.2, 'price': 0.8, 'terms': 1.0}
+
+@lru_cache(maxsize=65536)
+def _slot(feature):
+    # Signed feature hashing: collisions cancel out on average instead of
+    # always adding up.
+    h = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+    return h % DIMENSIONS, 1.0 if h >> 63 else -1.0
+
+def features(row):
+    vector = np.zeros(DIMENSIONS, dtype=np.float32)
+
+    def add(feature, weight):
+        index, sign = _slot(feature)
+        vector[index] += sign * weight
+
+    if row.get('medium'):
+        add('medium:' + row['medium'].lower(), FEATURE_WEIGHTS['medium'])
+    if row.get('artist_name'):
+        add('artist:' + row['artist_name'].lower(), FEATURE_WEIGHTS['artist'])
+    # Half-octave price bands; neighbouring bands count half so $480 and $520
+    # still look alike.
+    band = int(math.log2(max(float(row['price']), 1.0)) * 2)
+    add(f'price:{band}', FEATURE_WEIGHTS['price'])
+    add(f'price:{band - 1}', FEATURE_WEIGHTS['price'] / 2)
+    add(f'price:{band + 1}', FEATURE_WEIGHTS['price'] / 2)
+    terms = set(tokenize(row.get('title'))) | set(tokenize(row.get('description')))
+    for term in terms:
+        add('term:' + term, FEATURE_WEIGHTS['terms'] / math.sqrt(len(terms)))
+
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+class RecommendationIndex(ColumnarReadModel):
+    COLUMNS = {
+        '_vectors': (np.float32, (DIMENSIONS,), 0.0),
+        '_neighbours': (np.int32, (NEIGHBOURS,), -1),
+        '_scores': (np.float32, (NEIGHBOURS,), -np.inf),
+    }
+
+    def __init__(self):
+        self._loader = None
+        super().__init__()
+
+    def load_in_background(self):
+        with self._lock:
+            if self.loaded or self._loader is not None:
+                return
+            self._loader = threading.Thread(target=self._load_with, args=(current_app._get_current_object(),),
+                                            name='recommend-load', daemon=True)
+            self._loader.start()
+
+    def _load_with(self, app):
+        try:
+            with app.app_context():
+                self.ensure_loaded()
+        except Exception:
+            logger.exception('Could not build related artworks')
+        finally:
+            self._loader = None
+
+    def _source(self):
+        from project.db import get_searchable_artworks
+        return get_searchable_artworks()
+
+    def _add(self, row):
+        # Loading places every row first and computes all lists once, in
+        # _after_load; single additions are handled by add().
+        self._vectors[self._place(row)] = features(row)
+
+    def _after_load(self):
+        self._refresh(np.flatnonzero(self._alive[:self._size]))
+
+    def add(self, row):
+        with self._lock:
+            position = self._place(row)
+            self._vectors[position] = features(row)
+            self._refresh(np.array([position]))
+            # Join the lists of artworks it is now closer to than their
+            # current last neighbour.
+            n = self._size
+            similarity = self._vectors[:n] @ self._vectors[position]
+            closer = np.flatnonzero(self._alive[:n] & (similarity > self._scores[:n, -1]))
+            for other in closer:
+                if other == position or position in self._neighbours[other]:
+                    continue
+                neighbours = np.append(self._neighbours[other, :-1], position)
+                scores = np.append(self._scores[other, :-1], similarity[other])
+                order = np.argsort(-scores, kind='stable')
+                self._neighbours[other], self._scores[other] = neighbours[order], scores[order]
+
+    def _reset(self, capacity=1024):
+        super()._reset(capacity)
+        self._pending = None    # changes that arrived during a rebuild
+
+    def _on_artwork_changed(self, sender, artwork_id, status, artwork=None, **extra):
+        # Through apply(), so a change during a rebuild is replayed after it.
+        if self.loaded:
+            self.apply([dict(artwork, status=status) if status == 'available' and artwork is not None
+                        else {'id': artwork_id, 'status': status}])
+
+    def apply(self, artworks):
+        with self._lock:
+            if self._pending is not None:
+                # Still removed from the old table now; everything is
+                # replayed on the new one.
+                self._pending.extend(artworks)
+                for artwork in artworks:
+                    if artwork['status'] != 'available':
+                        self._remove(artwork['id'])
+                return
+            added = [artwork for artwork in artworks if artwork['status'] == 'available']
+            if len(added) < REBUILD_THRESHOLD:
+                self._apply_each(artworks)
+                return
+            for artwork in artworks:
+                if artwork['status'] != 'available':
+                    self._remove(artwork['id'])
+            alive = np.flatnonzero(self._alive[:self._size])
+            rows = [self._rows[position] for position in alive]
+            vectors = self._vectors[alive]
+            self._pending = pending = []
+            self._rebuild = threading.Thread(target=self._rebuild_with, args=(rows, vectors, added, pending),
+                                             name='recommend-rebuild', daemon=True)
+            self._rebuild.start()
+
+    def _apply_each(self, artworks):
+        for artwork in artworks:
+            if artwork['status'] == 'available':
+                self.add(artwork)
+            else:
+                self._remove(artwork['id'])
+
+    def _rebuild_with(self, rows, vectors, added, pending):
+        try:
+            table = RecommendationIndex.__new__(RecommendationIndex)
+            table._reset(max(1024, 2 * (len(rows) + len(added))))
+            for row, vector in zip(rows, vectors):
+                table._vectors[table._place(row)] = vector
+            for row in added:
+                table._add(row)
+            table._after_load()
+        except Exception:
+            # Not retried: a rebuild that fails once would likely fail again.
+            logger.exception('Rebuilding related artworks failed; adding %d artworks one by one', len(added))
+            table = None
+        with self._lock:
+            # Unless a reload replaced the table in the meantime.
+            if self._pending is pending:
+                self._pending = None
+                if table is not None:
+                    for name in (*self.COLUMNS, '_alive', '_size', '_rows', '_positions'):
+                        setattr(self, name, getattr(table, name))
+                    self.apply(pending)
+                else:
+                    self._apply_each(added + pending)
+
+    def _remove(self, artwork_id):
+        position = self._drop(artwork_id)
+        if position is None:
+            return
+        n = self._size
+        affected = np.flatnonzero(self._alive[:n] & (self._neighbours[:n] == position).any(axis=1))
+        self._refresh(affected)
+
+    def related(self, artwork_id, limit=4):
+        with self._lock:
+            position = self._positions.get(artwork_id)
+            if position is None:
+                return []
+            return [self._rows[other] for other in self._neighbours[position]
+                    if other >= 0 and self._alive[other]][:limit]
+
+    def _refresh(self, positions):
+        # Recompute the neighbour lists of `positions`, BATCH_SIZE rows of the
+        # similarity matrix at a time.
+        n = self._size
+        vectors, dead = self._vectors[:n], ~self._alive[:n]
+        k = min(NEIGHBOURS, n)
+        for start in range(0, len(positions), BATCH_SIZE):
+            batch = positions[start:start + BATCH_SIZE]
+            similarity = self._vectors[batch] @ vectors.T
+            similarity[:, dead] = -np.inf
+            similarity[np.arange(len(batch)), batch] = -np.inf
+            top = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+            scores = np.take_along_axis(similarity, top, axis=1)
+            order = np.argsort(-scores, axis=1, kind='stable')
+            top = np.take_along_axis(top, order, axis=1)
+            scores = np.take_along_axis(scores, order, axis=1)
+            top[np.isneginf(scores)] = -1
+            self._neighbours[batch] = -1
+            self._scores[batch] = -np.inf
+            self._neighbours[batch, :k] = top
+            self._scores[batch, :k] = scores
+
+recommendations = RecommendationIndex()
+
+def related_artworks(artwork_id, limit=4):
+    if not recommendations.loaded:
+        recommendations.load_in_background()
+        return []
+    return recommendations.related(artwork_id, limit)
@@ -0,0 +1,180 @@
+from datetime import date, timedelta
+import click
+from flask.cli import AppGroup
+from project import mysql
+from project.cache import platform_counts_cache
+from project.metrics import instrument
+
+# Sales rollups for the artist and admin dashboards. Every order adds its line
+# items to three summary tables in the same transaction that creates it, so a
+# dashboard reads a handful of precomputed rows instead of aggregating
+# orders/order_items. `flask sales rebuild` recomputes them from scratch.
+#
+#   sales_by_artwork  all-time units/revenue per artwork
+#   sales_by_artist   units/revenue per artist per day
+#   sales_by_day      platform units/revenue per day, split over
+#                     SALES_DAY_SLOTS rows so concurrent checkouts don't all
+#                     queue on one row lock; readers sum the slots.
+#
+# Revenue is the price of the items sold; shipping and tax are not included.
+
+SALES_DAY_SLOTS = 8
+
+def record_sale(cur, order_id):
+    # Call inside create_order's transaction, after its order_items exist.
+    cur.execute("""
+        INSERT INTO sales_by_artwork (artwork_id, artist_id, units, revenue, orders, last_sold_at)
+        SELECT oi.artwork_id, a.artist_id, SUM(oi.quantity), SUM(oi.price * oi.quantity), 1, o.created_at
+        FROM order_items oi
+        JOIN orders o ON o.id = oi.order_id
+        JOIN artworks a ON a.id = oi.artwork_id
+        WHERE oi.order_id = %s
+        GROUP BY oi.artwork_id, a.artist_id, o.created_at
+        ON DUPLICATE KEY UPDATE units = units + VALUES(units), revenue = revenue + VALUES(revenue),
+                                orders = orders + 1, last_sold_at = VALUES(last_sold_at)
+    """, (order_id,))
+    cur.execute("""
+        INSERT INTO sales_by_artist (artist_id, day, units, revenue, orders)
+        SELECT a.artist_id, DATE(o.created_at), SUM(oi.quantity), SUM(oi.price * oi.quantity), 1
+        FROM order_items oi
+        JOIN orders o ON o.id = oi.order_id
+        JOIN artworks a ON a.id = oi.artwork_id
+        WHERE oi.order_id = %s AND a.artist_id IS NOT NULL
+        GROUP BY a.artist_id, DATE(o.created_at)
+        ON DUPLICATE KEY UPDATE units = units + VALUES(units), revenue = revenue + VALUES(revenue),
+                                orders = orders + 1
+    """, (order_id,))
+    cur.execute("""
+        INSERT INTO sales_by_day (day, slot, units, revenue, orders)
+        SELECT DATE(o.created_at), MOD(o.id, %s), SUM(oi.quantity), SUM(oi.price * oi.quantity), 1
+        FROM order_items oi
+        JOIN orders o ON o.id = oi.order_id
+        WHERE oi.order_id = %s
+        GROUP BY DATE(o.created_at), o.id
+        ON DUPLICATE KEY UPDATE units = units + VALUES(units), revenue = revenue + VALUES(revenue),
+                                orders = orders + 1
+    """, (SALES_DAY_SLOTS, order_id))
+
+def rebuild_sales():
+    # One transaction: the dashboards never see half-rebuilt tables. Orders
+    # placed while this runs wait on its locks and are counted exactly once.
+    cur = mysql.connection.cursor()
+    try:
+        for table in ('sales_by_artwork', 'sales_by_artist', 'sales_by_day'):
+            cur.execute(f"DELETE FROM {table}")
+        cur.execute("""
+            INSERT INTO sales_by_artwork (artwork_id, artist_id, units, revenue, orders, last_sold_at)
+            SELECT oi.artwork_id, a.artist_id, SUM(oi.quantity), SUM(oi.price * oi.quantity),
+                   COUNT(DISTINCT oi.order_id), MAX(o.created_at)
+            FROM order_items oi
+            JOIN orders o ON o.id = oi.order_id
+            JOIN artworks a ON a.id = oi.artwork_id
+            GROUP BY oi.artwork_id, a.artist_id
+        """)
+        cur.execute("""
+            INSERT INTO sales_by_artist (artist_id, day, units, revenue, orders)
+            SELECT a.artist_id, DATE(o.created_at), SUM(oi.quantity), SUM(oi.price * oi.quantity),
+                   COUNT(DISTINCT oi.order_id)
+            FROM order_items oi
+            JOIN orders o ON o.id = oi.order_id
+            JOIN artworks a ON a.id = oi.artwork_id
+            WHERE a.artist_id IS NOT NULL
+            GROUP BY a.artist_id, DATE(o.created_at)
+        """)
+        cur.execute("""
+            INSERT INTO sales_by_day (day, slot, units, revenue, orders)
+            SELECT DATE(o.created_at), MOD(o.id, %s), SUM(oi.quantity), SUM(oi.price * oi.quantity),
+                   COUNT(DISTINCT oi.order_id)
+            FROM order_items oi
+            JOIN orders o ON o.id = oi.order_id
+            GROUP BY DATE(o.created_at), MOD(o.id, %s)
+        """, (SALES_DAY_SLOTS, SALES_DAY_SLOTS))
+        cur.execute("SELECT COUNT(*) AS rows_built FROM sales_by_artwork")
+        rows = cur.fetchone()['rows_built']
+        mysql.commit()
+    except Exception as e:
+        mysql.connection.rollback()
+        raise e
+    finally:
+        cur.close()
+    return rows
+
+def get_artist_sales(artist_id, recent=5):
+    month_start = date.today().replace(day=1)
+    cur = mysql.read_connection.cursor()
+    cur.execute("""
+        SELECT COALESCE(SUM(units), 0) AS units, COALESCE(SUM(revenue), 0) AS revenue,
+               COALESCE(SUM(CASE WHEN day >= %s THEN units END), 0) AS month_units,
+               COALESCE(SUM(CASE WHEN day >= %s THEN revenue END), 0) AS month_revenue
+        FROM sales_by_artist
+        WHERE artist_id = %s
+    """, (month_start, month_start, artist_id))
+    summary = cur.fetchone()
+    cur.execute("SELECT COUNT(*) AS listed FROM artworks WHERE artist_id = %s AND status = 'available'", (artist_id,))
+    summary['listed'] = cur.fetchone()['listed']
+    cur.execute("""
+        SELECT s.artwork_id, a.title, s.units, s.revenue, s.last_sold_at
+        FROM sales_by_artwork s
+        JOIN artworks a ON a.id = s.artwork_id
+        WHERE s.artist_id = %s
+        ORDER BY s.last_sold_at DESC
+        LIMIT %s
+    """, (artist_id, recent))
+    summary['recent'] = cur.fetchall()
+    cur.close()
+    return summary
+
+def get_platform_sales(days=30, top=5):
+    today = date.today()
+    month_start = today.replace(day=1)
+    since = min(today - timedelta(days=days - 1), month_start)
+    cur = mysql.read_connection.cursor()
+    cur.execute("""
+        SELECT day, SUM(units) AS units, SUM(revenue) AS revenue, SUM(orders) AS orders
+        FROM sales_by_day
+        WHERE day >= %s
+        GROUP BY day
+        ORDER BY day DESC
+    """, (since,))
+    rows = cur.fetchall()
+    cur.execute("""
+        SELECT s.artwork_id, a.title, a.artist_name, s.units, s.revenue
+        FROM sales_by_artwork s
+        JOIN artworks a ON a.id = s.artwork_id
+        ORDER BY s.revenue DESC
+        LIMIT %s
+    """, (top,))
+    top_artworks = cur.fetchall()
+    cur.close()
+    counts = platform_counts_cache.get_or_load('platform', _fetch_platform_counts)
+    return {
+        'daily': [row for row in rows if row['day'] > today - timedelta(days=days)],
+        'top_artworks': top_artworks,
+        'users': counts['users'],
+        'artists': counts['artists'],
+        'listed': counts['listed'],
+        'month_revenue': sum(row['revenue'] for row in rows if row['day'] >= month_start),
+        'period_revenue': sum(row['revenue'] for row in rows if row['day'] > today - timedelta(days=days)),
+        'days': days,
+    }
+
+def _fetch_platform_counts():
+    cur = mysql.read_connection.cursor()
+    cur.execute("SELECT role, COUNT(*) AS users FROM users GROUP BY role")
+    users = {row['role']: row['users'] for row in cur.fetchall()}
+    cur.execute("SELECT COUNT(*) AS listed FROM artworks WHERE status = 'available'")
+    listed = cur.fetchone()['listed']
+    cur.close()
+    return {'users': sum(users.values()), 'artists': users.get('artist', 0), 'listed': listed}
+
+sales_cli = AppGroup('sales', help='Sales rollup tables.')
+
+@sales_cli.command('rebuild')
+def rebuild_command():
+    """Recompute the sales rollups from orders and order_items."""
+    click.echo(f'Rebuilt sales rollups: {rebuild_sales()} artworks with sales')
+
+def init_app(app):
+    app.cli.add_command(sales_cli)
+
+instrument(globals(), ['record_sale', 'rebuild_sales', 'get_artist_sales', 'get_platform_sales'])
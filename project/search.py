@@ -0,0 +1,139 @@
+import math
+import re
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+from project.readmodel import ReadModel
+
+# In-memory inverted index over the available catalog. Answers the ?query=
+# searches from /artworks without touching MySQL.
+
+FIELD_WEIGHTS = {'title': 3.0, 'artist_name': 2.5, 'medium': 1.5, 'description': 1.0}
+STOPWORDS = frozenset(['a', 'an', 'and', 'by', 'for', 'in', 'of', 'on', 'the', 'to', 'with'])
+MIN_PREFIX_LENGTH = 2
+MAX_PREFIX_EXPANSIONS = 64
+PREFIX_PENALTY = 0.6
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+def tokenize(text):
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode().lower()
+    return [token for token in _TOKEN_RE.findall(text) if token not in STOPWORDS]
+
+class SearchIndex(ReadModel):
+    def _reset(self):
+        self._postings = defaultdict(dict)   # term -> {artwork_id: weight}
+        self._doc_terms = {}                 # artwork_id -> terms, for removal
+        self._docs = {}                      # artwork_id -> grid row
+        self._vocabulary = []
+        self._vocabulary_dirty = False
+
+    def _source(self):
+        from project.db import get_searchable_artworks
+        return get_searchable_artworks()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _add(self, row):
+        self._remove(row['id'])
+        weights = defaultdict(float)
+        for field, field_weight in FIELD_WEIGHTS.items():
+            counts = defaultdict(int)
+            for token in tokenize(row.get(field)):
+                counts[token] += 1
+            for token, tf in counts.items():
+                weights[token] += field_weight * (1 + math.log(tf))
+        artwork_id = row['id']
+        for token, weight in weights.items():
+            postings = self._postings[token]
+            if not postings:
+                self._vocabulary_dirty = True
+            postings[artwork_id] = weight
+        self._doc_terms[artwork_id] = tuple(weights)
+        self._docs[artwork_id] = {key: value for key, value in row.items() if key != 'description'}
+
+    def _remove(self, artwork_id):
+        for token in self._doc_terms.pop(artwork_id, ()):
+            postings = self._postings[token]
+            postings.pop(artwork_id, None)
+            if not postings:
+                del self._postings[token]
+                self._vocabulary_dirty = True
+        self._docs.pop(artwork_id, None)
+
+    def _expand(self, token):
+        # Exact match first, then other indexed terms starting with the token
+        # so that "wat" finds "watercolor" while the visitor is still typing.
+        matches = []
+        if token in self._postings:
+            matches.append((token, 1.0))
+        if len(token) >= MIN_PREFIX_LENGTH:
+            if self._vocabulary_dirty:
+                self._vocabulary = sorted(self._postings)
+                self._vocabulary_dirty = False
+            i = bisect_left(self._vocabulary, token)
+            while i < len(self._vocabulary) and len(matches) < MAX_PREFIX_EXPANSIONS:
+                term = self._vocabulary[i]
+                if not term.startswith(token):
+                    break
+                if term != token:
+                    matches.append((term, PREFIX_PENALTY))
+                i += 1
+        return matches
+
+    def _scores(self, query):
+        # Every query token has to match (exactly or as a prefix); documents
+        # are scored by field-weighted tf-idf.
+        tokens = tokenize(query)
+        if not tokens:
+            return {}
+        total_docs = len(self._docs) or 1
+        scores = None
+        for token in dict.fromkeys(tokens):
+            token_scores = {}
+            for term, factor in self._expand(token):
+                postings = self._postings[term]
+                idf = math.log(1 + total_docs / len(postings))
+                for artwork_id, weight in postings.items():
+                    score = weight * idf * factor
+                    if score > token_scores.get(artwork_id, 0):
+                        token_scores[artwork_id] = score
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {artwork_id: score + token_scores[artwork_id]
+                          for artwork_id, score in scores.items() if artwork_id in token_scores}
+            if not scores:
+                return {}
+        return scores
+
+    def matching_ids(self, query):
+        with self._lock:
+            return set(self._scores(query))
+
+    def search(self, query, sort=None, limit=24, offset=0, ids=None):
+        # Returns (rows, total); `ids` restricts the results to those artworks.
+        with self._lock:
+            scores = self._scores(query)
+            if ids is not None:
+                scores = {artwork_id: score for artwork_id, score in scores.items() if artwork_id in ids}
+            docs = self._docs
+            if sort == 'price_asc':
+                ranked = sorted(scores, key=lambda i: (docs[i]['price'], i))
+            elif sort == 'price_desc':
+                ranked = sorted(scores, key=lambda i: (docs[i]['price'], i), reverse=True)
+            elif sort == 'newest':
+                ranked = sorted(scores, key=lambda i: (docs[i]['created_at'], i), reverse=True)
+            else:
+                ranked = sorted(scores, key=lambda i: (-scores[i], -i))
+            return [docs[i] for i in ranked[offset:offset + limit]], len(ranked)
+
+search_index = SearchIndex()
+
+def search_artworks(query, sort=None, limit=24, offset=0, ids=None):
+    return search_index.ensure_loaded().search(query, sort=sort, limit=limit, offset=offset, ids=ids)
+
+def search_matching_ids(query):
+    return search_index.ensure_loaded().matching_ids(query)
@@ -1,6 +1,14 @@
-from project.db import get_user_by_id
+import time
+from flask import session
+from project.db import get_cart_count, get_session_user
 from project import login_manager
 
+# Bumped whenever the user changes their own record; cached session users
+# loaded under an older version are refetched.
+USER_VERSION_KEY = '_user_version'
+# Bumped whenever the user changes their cart, for the same reason.
+CART_VERSION_KEY = '_cart_version'
+
 @login_manager.user_loader
 def load_user(user_id):
     if user_id is None:
@@ -9,4 +17,13 @@ def load_user(user_id):
         user_id = int(user_id)
     except ValueError:
         return None
-    return get_user_by_id(user_id)
\ No newline at end of file
+    return get_session_user(user_id, session.get(USER_VERSION_KEY))
+
+def bump_user_version():
+    session[USER_VERSION_KEY] = time.time_ns()
+
+def bump_cart_version():
+    session[CART_VERSION_KEY] = time.time_ns()
+
+def session_cart_count(user_id):
+    return get_cart_count(user_id, session.get(CART_VERSION_KEY))
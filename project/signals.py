@@ -0,0 +1,16 @@
+from blinker import Namespace
+
+# Catalog change notifications. The in-process read models (search index,
+# caches, ...) subscribe to these instead of the db layer calling each of them.
+_signals = Namespace()
+
+# Sent after this process changes an artwork.
+# kwargs: artwork_id, status, artwork (grid row, or None when not available),
+#         version (the catalog version the change committed as)
+artwork_changed = _signals.signal('artwork-changed')
+
+# Sent when this process catches up with artworks changed by other processes
+# (see httpcache.CatalogVersion).
+# kwargs: artworks (current rows with status; any not 'available' is gone),
+#         or None when the changes are no longer known and everything is stale
+catalog_synced = _signals.signal('catalog-synced')
@@ -0,0 +1,65 @@
+import os
+import time
+from contextlib import contextmanager
+from jinja2 import FileSystemBytecodeCache
+
+# Work the production profile does before a worker takes traffic, so the
+# first requests after a (rolling) restart are no slower than the rest:
+# compile every template into a bytecode cache shared by all workers, and
+# fill the catalog, search, facet, recommendation and availability caches.
+# Run it in the master (`gunicorn --preload wsgi:app`) and forked workers
+# start with all of it.
+
+@contextmanager
+def timed(timings, phase):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = time.perf_counter() - started
+
+def precompile_templates(app):
+    cache_dir = app.config.get('TEMPLATE_CACHE_DIR') or os.path.join(app.instance_path, 'jinja-cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    env = app.jinja_env
+    env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    # Templates don't change under a running production worker, so skip the
+    # per-render stat of every template file.
+    env.auto_reload = False
+    names = env.list_templates(extensions=('html',))
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+def prewarm(app):
+    from project.availability import availability
+    from project.db import ARTWORK_SORTS, get_artworks_page
+    from project.facets import FacetFilter, facet_counts
+    from project.httpcache import catalog_version
+    from project.recommend import recommendations
+    from project.search import search_artworks
+    from project.views import ARTWORKS_PER_PAGE
+    with app.app_context():
+        catalog_version.get()
+        for sort in ARTWORK_SORTS:
+            get_artworks_page(sort=sort, limit=ARTWORKS_PER_PAGE)
+        search_artworks('')
+        facet_counts(FacetFilter())
+        recommendations.ensure_loaded()
+        availability.ensure_loaded()
+
+def prepare(app, started):
+    timings = {'create_app': time.perf_counter() - started}
+    with timed(timings, 'templates'):
+        count = precompile_templates(app)
+    try:
+        with timed(timings, 'prewarm'):
+            prewarm(app)
+    except Exception:
+        # Not fatal: everything warmed here also loads on first use.
+        app.logger.exception('Cache pre-warm failed; caches will fill on demand')
+    timings['total'] = time.perf_counter() - started
+    app.extensions['startup_timings'] = timings
+    app.logger.info('Started in %.3fs (%s); %d templates compiled', timings['total'],
+                    ', '.join(f'{phase} {seconds:.3f}s' for phase, seconds in timings.items() if phase != 'total'),
+                    count)
@@ -1,15 +1,34 @@
-from flask import Blueprint, render_template, request, session, flash, redirect, url_for, jsonify
+import json
+import MySQLdb
+from flask import Blueprint, current_app, render_template, request, session, flash, redirect, url_for, jsonify
 from flask_login import login_user, logout_user, login_required, current_user
-from project.forms import RegistrationForm, ArtistRegistrationForm, LoginForm, ProfileForm
-from project.db import (create_user, get_user_by_username, update_user_profile, 
-                        get_all_artworks, get_artwork_by_id, add_to_cart, 
-                        get_cart_items, remove_from_cart, get_cart_total,
-                        create_order, get_user_orders, get_cart_count)
-from project.wrappers import admin_required, artist_required
+from project.models import ArtworkPage
+from project.forms import RegistrationForm, ArtistRegistrationForm, LoginForm, ProfileForm, ArtworkImportForm
+from project.db import (create_user, get_user_by_username, get_user_by_id, update_user_profile,
+                        update_password_hash, get_artworks_page, get_artwork_by_id, add_to_cart, 
+                        add_many_to_cart, remove_from_cart, create_order,
+                        CartChanged, get_order_history)
+from project.wrappers import admin_required, artist_required, role_required
+from project.httpcache import conditional
+from project.cache import catalog_cache
+from project.hashing import HashingUnavailable, password_hasher
+from project.pricing import Quote, quote_cart
+from project.sales import get_artist_sales, get_platform_sales
+from project.search import search_artworks, search_matching_ids
+from project.facets import FacetFilter, facet_counts, facet_matching_ids, facet_page
+from project.recommend import related_artworks
+from project.importer import get_import, guess_format, queue_upload, start_import
+from project.session import bump_cart_version, bump_user_version, session_cart_count
 
 main = Blueprint('main', __name__)
 
+ARTWORKS_PER_PAGE = 24
+ORDERS_PER_PAGE = 10
+CHECKOUT_QUOTE_KEY = 'checkout_quote'
+MAX_BULK_CART_ITEMS = 100
+
 @main.route('/')
+@conditional
 def index():
     tiles = [
         {'title': 'Abstract Art', 'img': 'img/feature-slide-1.png', 'url': url_for('main.artworks'), 'link_title': 'Explore Collection'},
@@ -31,6 +50,9 @@ def register_customer():
             create_user(form, role='customer')
             flash('Registration successful! Please log in.', 'success')
             return redirect(url_for('main.login'))
+        except MySQLdb.IntegrityError:
+            if not form.mark_taken():
+                flash('Registration failed. Please try again.', 'danger')
         except Exception as e:
             flash('Registration failed. Please try again.', 'danger')
     return render_template('register.html', form=form, title='Customer Registration')
@@ -46,6 +68,9 @@ def register_artist():
             create_user(form, role='artist')
             flash('Artist registration successful! Please log in.', 'success')
             return redirect(url_for('main.login'))
+        except MySQLdb.IntegrityError:
+            if not form.mark_taken():
+                flash('Registration failed. Please try again.', 'danger')
         except Exception as e:
             flash('Registration failed. Please try again.', 'danger')
     return render_template('register.html', form=form, title='Artist Registration')
@@ -58,7 +83,18 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         user = get_user_by_username(form.username.data)
-        if user and user.check_password(form.password.data):
+        try:
+            valid = user is not None and user.check_password(form.password.data)
+        except HashingUnavailable:
+            flash('We are experiencing heavy traffic. Please try again in a moment.', 'warning')
+            return render_template('login.html', form=form, title='Login')
+        if valid:
+            # Hashes made with older parameters are upgraded while we have the password.
+            if password_hasher.needs_rehash(user.password_hash):
+                try:
+                    update_password_hash(user.id, password_hasher.hash(form.password.data))
+                except Exception:
+                    current_app.logger.exception('Password rehash failed for user %s', user.id)
             session.permanent = True
             login_user(user)
             flash(f'Welcome back, {user.firstname}!', 'success')
@@ -86,9 +122,11 @@ def logout():
 @main.route('/profile', methods=['GET', 'POST'])
 @login_required
 def profile():
-    form = ProfileForm(obj=current_user)
+    # current_user is the trimmed session user; the form needs the full profile.
+    form = ProfileForm(obj=get_user_by_id(current_user.id))
     if form.validate_on_submit():
         update_user_profile(current_user.id, form)
+        bump_user_version()
         flash('Profile updated successfully', 'success')
         return redirect(url_for('main.profile'))
     return render_template('profile.html', form=form, title='Profile')
@@ -96,38 +134,111 @@ def profile():
 @main.route('/artist/dashboard')
 @artist_required
 def artist_dashboard():
-    return render_template('artist_dashboard.html', title='Artist Dashboard')
+    return render_template('artist_dashboard.html', title='Artist Dashboard', sales=get_artist_sales(current_user.id))
 
 @main.route('/admin/dashboard')
 @admin_required
 def admin_dashboard():
-    return render_template('admin_dashboard.html', title='Admin Dashboard')
+    return render_template('admin_dashboard.html', title='Admin Dashboard', sales=get_platform_sales())
+
+@main.route('/artworks/import', methods=['GET', 'POST'])
+@role_required('artist', 'admin')
+def import_artworks_upload():
+    form = ArtworkImportForm()
+    if form.validate_on_submit():
+        upload = form.file.data
+        source = upload.filename
+        fmt = form.format.data or guess_format(source)
+        # Artists import their own work; admins may set artist_id per row.
+        artist = (current_user.id, f'{current_user.firstname} {current_user.lastname}') if current_user.role == 'artist' else None
+        job_id = form.resume.data
+        if job_id:
+            job = get_import(job_id)
+            if job is None or job['user_id'] != current_user.id or job['source'] != source or job['status'] != 'failed':
+                flash(f'Import #{job_id} cannot be resumed with {source}.', 'danger')
+                return render_template('import_artworks.html', form=form, job=None, title='Import Artworks')
+        else:
+            job_id = start_import(current_user.id, source, fmt)
+        queue_upload(upload, job_id, fmt, artist)
+        flash(f'Import #{job_id} queued.', 'info')
+        return redirect(url_for('main.import_artworks_upload', job=job_id))
+    job_id = request.args.get('job', type=int)
+    job = get_import(job_id) if job_id else None
+    if job is not None and job['user_id'] == current_user.id:
+        job = dict(job, errors=json.loads(job['errors'] or '[]'))
+    else:
+        job = None
+    return render_template('import_artworks.html', form=form, job=job, title='Import Artworks')
 
 @main.route('/artworks')
+@conditional
 def artworks():
-    artworks_list = get_all_artworks()
-    return render_template('artworks.html', title='Browse Artworks', artworks=artworks_list)
+    query = request.args.get('query', '').strip()
+    filters = FacetFilter.from_args(request.args)
+    offset = request.args.get('after') or request.args.get('before')
+    if query:
+        page = search_page(query, request.args.get('sort', 'relevance'), offset, filters)
+        facets = facet_counts(filters, ids=search_matching_ids(query))
+    elif filters:
+        page = facet_page_for(filters, request.args.get('sort', 'newest'), offset)
+        facets = facet_counts(filters)
+    else:
+        page = get_artworks_page(sort=request.args.get('sort', 'newest'),
+                                 after=request.args.get('after'),
+                                 before=request.args.get('before'),
+                                 limit=ARTWORKS_PER_PAGE)
+        facets = facet_counts(filters)
+    return render_template('artworks.html', title='Browse Artworks', artworks=page.items, page=page,
+                           filters=filters, facets=facets)
+
+def _offset(value):
+    try:
+        return max(int(value), 0) if value else 0
+    except ValueError:
+        return 0
+
+def _offset_page(items, total, sort, offset, query=None):
+    # Search and facet results are ranked in memory, so their cursors are
+    # plain offsets.
+    page = ArtworkPage(items=items, sort=sort, limit=ARTWORKS_PER_PAGE, query=query, total=total)
+    if offset + ARTWORKS_PER_PAGE < total:
+        page.next_cursor = str(offset + ARTWORKS_PER_PAGE)
+    if offset > 0:
+        page.prev_cursor = str(max(offset - ARTWORKS_PER_PAGE, 0))
+    return page
+
+def search_page(query, sort, offset, filters=None):
+    offset = _offset(offset)
+    ids = facet_matching_ids(filters) if filters else None
+    items, total = search_artworks(query, sort=sort, limit=ARTWORKS_PER_PAGE, offset=offset, ids=ids)
+    return _offset_page(items, total, sort, offset, query=query)
+
+def facet_page_for(filters, sort, offset):
+    offset = _offset(offset)
+    items, total = facet_page(filters, sort=sort, limit=ARTWORKS_PER_PAGE, offset=offset)
+    return _offset_page(items, total, sort, offset)
 
 @main.route('/artwork/<int:artwork_id>')
+@conditional
 def artwork_detail(artwork_id):
     artwork = get_artwork_by_id(artwork_id)
     if not artwork:
         flash('Artwork not found', 'danger')
         return redirect(url_for('main.artworks'))
-    return render_template('artwork_detail.html', title=artwork['title'], artwork=artwork)
+    return render_template('artwork_detail.html', title=artwork['title'], artwork=artwork,
+                           related=related_artworks(artwork_id))
 
 @main.route('/add-to-cart/<int:artwork_id>', methods=['POST'])
 @login_required
 def add_cart(artwork_id):
-    artwork = get_artwork_by_id(artwork_id)
-    if not artwork:
-        flash('Artwork not found', 'danger')
-        return redirect(url_for('main.artworks'))
-    
+    session.pop(CHECKOUT_QUOTE_KEY, None)
     if add_to_cart(current_user.id, artwork_id):
-        flash(f'"{artwork["title"]}" added to cart!', 'success')
+        bump_cart_version()
+        # Title only if the artwork is already cached; not worth a query.
+        artwork = catalog_cache.artworks.get(artwork_id)
+        flash(f'"{artwork["title"]}" added to cart!' if artwork else 'Artwork added to cart!', 'success')
     else:
-        flash('Failed to add item to cart', 'danger')
+        flash('That artwork is no longer available', 'danger')
     
     referrer = request.referrer
     if referrer and referrer.endswith(f'/artwork/{artwork_id}'):
@@ -135,22 +246,57 @@ def add_cart(artwork_id):
     else:
         return redirect(request.referrer or url_for('main.artworks'))
 
+@main.route('/add-to-cart/bulk', methods=['POST'])
+@login_required
+def add_cart_bulk():
+    # JSON bodies are a list of ids or {"artwork_ids": [...]}; forms repeat
+    # the artwork_ids field.
+    error = None
+    if request.is_json:
+        payload = request.get_json(silent=True)
+        artwork_ids = payload.get('artwork_ids') if isinstance(payload, dict) else payload
+        if not isinstance(artwork_ids, list) or not all(
+                isinstance(artwork_id, int) and not isinstance(artwork_id, bool) for artwork_id in artwork_ids):
+            error = 'artwork_ids must be a list of integers'
+    else:
+        try:
+            artwork_ids = [int(artwork_id) for artwork_id in request.form.getlist('artwork_ids')]
+        except ValueError:
+            error = 'artwork_ids must be integers'
+    if error is None and len(artwork_ids) > MAX_BULK_CART_ITEMS:
+        error = f'At most {MAX_BULK_CART_ITEMS} artworks can be added at once'
+    if error is not None:
+        if request.is_json:
+            return jsonify(error=error), 400
+        flash(error, 'danger')
+        return redirect(request.referrer or url_for('main.basket'))
+
+    session.pop(CHECKOUT_QUOTE_KEY, None)
+    added = add_many_to_cart(current_user.id, artwork_ids)
+    if added:
+        bump_cart_version()
+    if request.is_json:
+        return jsonify(added=added, cart_count=session_cart_count(current_user.id)), (200 if added else 400)
+    if added:
+        flash('Artworks added to cart!', 'success')
+    else:
+        flash('None of those artworks are available', 'danger')
+    return redirect(request.referrer or url_for('main.basket'))
+
 @main.route('/basket')
 @login_required
 def basket():
-    items = get_cart_items(current_user.id)
-    subtotal = get_cart_total(current_user.id)
-    shipping = 45.00 if subtotal > 0 else 0
-    tax = float(subtotal) * 0.08
-    total = float(subtotal) + shipping + tax
+    quote = quote_cart(current_user.id)
     return render_template('basket.html', title='Shopping Basket', 
-                         items=items, subtotal=subtotal, shipping=shipping, 
-                         tax=tax, total=total)
+                         items=quote.items, unavailable=quote.unavailable, subtotal=quote.subtotal,
+                         shipping=quote.shipping, tax=quote.tax, total=quote.total)
 
 @main.route('/remove-from-cart/<int:cart_id>', methods=['POST'])
 @login_required
 def remove_cart(cart_id):
+    session.pop(CHECKOUT_QUOTE_KEY, None)
     if remove_from_cart(cart_id, current_user.id):
+        bump_cart_version()
         flash('Item removed from cart', 'success')
     else:
         flash('Could not remove item', 'danger')
@@ -159,31 +305,27 @@ def remove_cart(cart_id):
 @main.route('/checkout')
 @login_required
 def checkout():
-    items = get_cart_items(current_user.id)
-    if not items:
+    quote = quote_cart(current_user.id)
+    if quote.unavailable:
+        flash('Some artworks in your cart have been sold. Please remove them before checking out.', 'warning')
+        return redirect(url_for('main.basket'))
+    if not quote.items:
         flash('Your cart is empty', 'warning')
         return redirect(url_for('main.artworks'))
     
-    subtotal = get_cart_total(current_user.id)
-    shipping = 45.00
-    tax = float(subtotal) * 0.08
-    total = float(subtotal) + shipping + tax
+    # Payment charges exactly what was shown here, without pricing the cart again.
+    session[CHECKOUT_QUOTE_KEY] = quote.to_session()
     return render_template('checkout.html', title='Checkout',
-                         items=items, subtotal=subtotal, shipping=shipping,
-                         tax=tax, total=total)
+                         items=quote.items, subtotal=quote.subtotal, shipping=quote.shipping,
+                         tax=quote.tax, total=quote.total)
 
 @main.route('/process-payment', methods=['POST'])
 @login_required
 def process_payment():
-    items = get_cart_items(current_user.id)
-    if not items:
-        flash('Cart is empty', 'danger')
-        return redirect(url_for('main.artworks'))
-    
-    subtotal = get_cart_total(current_user.id)
-    shipping = 45.00
-    tax = float(subtotal) * 0.08
-    total = float(subtotal) + shipping + tax
+    quote = Quote.from_session(session.get(CHECKOUT_QUOTE_KEY) or {})
+    if quote is None:
+        flash('Please review your order before paying.', 'warning')
+        return redirect(url_for('main.checkout'))
     
     card_number = request.form.get('card_number')
     payment_method = request.form.get('payment_method', 'credit_card')
@@ -191,10 +333,16 @@ def process_payment():
     shipping_addr = f"{current_user.address}, {current_user.city}, {current_user.state} {current_user.zip}"
     
     try:
-        order_id = create_order(current_user.id, total, shipping, tax, 
-                               shipping_addr, payment_method)
+        order_id = create_order(current_user.id, quote.total, quote.shipping, quote.tax, 
+                               shipping_addr, payment_method, expected_subtotal=quote.subtotal)
+        bump_cart_version()
+        session.pop(CHECKOUT_QUOTE_KEY, None)
         flash('Payment successful! Order placed.', 'success')
         return redirect(url_for('main.order_success', order_id=order_id))
+    except CartChanged:
+        session.pop(CHECKOUT_QUOTE_KEY, None)
+        flash('Your cart changed since checkout. Please review your order.', 'warning')
+        return redirect(url_for('main.checkout'))
     except Exception as e:
         flash('Payment failed. Please try again.', 'danger')
         return redirect(url_for('main.checkout'))
@@ -207,5 +355,5 @@ def order_success(order_id):
 @main.route('/my-orders')
 @login_required
 def my_orders():
-    orders = get_user_orders(current_user.id)
-    return render_template('my_orders.html', orders=orders)
\ No newline at end of file
+    page = get_order_history(current_user.id, after=request.args.get('after'), limit=ORDERS_PER_PAGE)
+    return render_template('my_orders.html', orders=page.orders, page=page)
\ No newline at end of file
@@ -1,13 +1,13 @@
 from functools import wraps
-from flask import abort, flash, redirect, url_for
+from flask import abort, flash, g, redirect, url_for
 from flask_login import current_user, login_required
 
-def role_required(required_role):
+def role_required(*roles):
     def decorator(f):
         @login_required
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            if current_user.role != required_role:
+            if current_user.role not in roles:
                 flash('Access denied. You do not have the required permission', 'danger')
                 return redirect(url_for('main.profile'))
             return f(*args, **kwargs)
@@ -15,4 +15,15 @@ def role_required(required_role):
     return decorator
 
 admin_required = role_required('admin')
-artist_required = role_required('artist')
\ No newline at end of file
+artist_required = role_required('artist')
+
+def request_memoized(f):
+    # Computes f(*args) at most once per request, however many templates ask.
+    @wraps(f)
+    def decorated_function(*args):
+        memo = g.setdefault('_request_memo', {})
+        key = (f.__name__,) + args
+        if key not in memo:
+            memo[key] = f(*args)
+        return memo[key]
+    return decorated_function
@@ -2,4 +2,4 @@ from project import create_app
 
 if __name__ == '__main__':
     app = create_app()
-    app.run(debug = True)
\ No newline at end of file
+    app.run(debug=app.debug, use_reloader=app.debug)
@@ -0,0 +1,48 @@
+import threading
+import time
+import project.db
+from project.availability import AvailabilityChecker
+
+def test_concurrent_first_checks_share_one_load(monkeypatch):
+    scans = []
+
+    def iter_user_identities():
+        scans.append(threading.get_ident())
+        for i in range(200):
+            time.sleep(0.001)
+            yield f'user{i}', f'user{i}@example.com'
+
+    monkeypatch.setattr(project.db, 'iter_user_identities', iter_user_identities)
+    monkeypatch.setattr(project.db, 'users_exist', lambda username, email: (username is not None, email is not None))
+    checker = AvailabilityChecker(capacity=1000)
+    start = threading.Barrier(8)
+    results, errors = [], []
+
+    def register(i):
+        start.wait()
+        try:
+            results.append(checker.check(f'user{i}', f'new{i}@example.com'))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=register, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(scans) == 1
+    assert results == [(True, False)] * 8
+    assert checker.loaded and checker._pending is None
+
+def test_registration_during_load_is_kept(monkeypatch):
+    checker = AvailabilityChecker(capacity=1000)
+
+    def identities():
+        yield 'existing', 'existing@example.com'
+        checker.add('racer', 'racer@example.com')
+
+    checker.load(identities())
+    assert 'racer' in checker.usernames and 'racer@example.com' in checker.emails
+    assert 'existing' in checker.usernames
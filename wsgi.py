@@ -0,0 +1,5 @@
+from project import create_app
+
+# Production entry point:
+#   ARTSPACE_PROFILE=production SECRET_KEY=... gunicorn --preload -w 4 wsgi:app
+app = create_app()